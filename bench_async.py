@@ -0,0 +1,82 @@
+"""
+Load test for the sync (WSGI) and async (ASGI) read endpoints.
+
+Start the same code base twice, then point this script at both:
+
+    gunicorn postpartum_project.wsgi:application -w 4 -b 127.0.0.1:8000
+    gunicorn postpartum_project.asgi:application -w 4 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8001
+
+    python bench_async.py --token <api token> --patient <patient id> --concurrency 64 --requests 2000
+
+Each endpoint is hit with --concurrency requests in flight at once, the sync
+server on the DRF urls and the async server on the /api/async/ urls.
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ENDPOINTS = [
+    ('observation list', '/api/observations/', '/api/async/observations/'),
+    ('patient detail', '/api/patients/{patient}/', '/api/async/patients/{patient}/'),
+    ('questionnaire responses', '/api/questionnaire-responses/', '/api/async/questionnaire-responses/'),
+]
+
+local = threading.local()
+
+
+def session(token):
+    if not hasattr(local, 'session'):
+        local.session = requests.Session()
+        local.session.headers['Authorization'] = f'Token {token}'
+    return local.session
+
+
+def run(url, token, concurrency, total):
+    def fetch(_):
+        start = time.perf_counter()
+        response = session(token).get(url, timeout=30)
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, code in results)
+    errors = sum(1 for latency, code in results if code != 200)
+    return {
+        'rps': total / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sync', default='http://127.0.0.1:8000', help='WSGI server')
+    parser.add_argument('--async', dest='async_url', default='http://127.0.0.1:8001', help='ASGI server')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--patient', required=True)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent")
+    for label, sync_path, async_path in ENDPOINTS:
+        print(label)
+        for server, base, path in (('wsgi', args.sync, sync_path), ('asgi', args.async_url, async_path)):
+            url = base + path.format(patient=args.patient)
+            # warm up connections and caches
+            run(url, args.token, args.concurrency, args.concurrency)
+            result = run(url, args.token, args.concurrency, args.requests)
+            print(f"  {server:<5} {result['rps']:8.0f} req/s  p50 {result['p50']:7.1f} ms  "
+                  f"p95 {result['p95']:7.1f} ms  errors {result['errors']}")
+
+
+if __name__ == '__main__':
+    main()
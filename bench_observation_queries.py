@@ -0,0 +1,139 @@
+"""
+Benchmark for the observation query paths.
+
+Seeds observations (10M by default) across a set of test patients, then runs
+the ObservationViewSet date range query and a per-code query with and without
+the composite indexes from migration 0002, printing EXPLAIN plans and p50/p99
+latency for each.
+
+    python bench_observation_queries.py --rows 10000000 --patients 5000
+    python bench_observation_queries.py --skip-seed   # reuse seeded rows
+    python bench_observation_queries.py --cleanup     # remove bench patients
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import date, timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "postpartum_project.settings")
+django.setup()
+
+from django.db import connection, transaction
+from django.utils import timezone
+from postpartum_api.models import Patient, Observation
+
+BENCH_PREFIX = 'BENCH-'
+
+
+def seed(rows, patients, batch_size):
+    codes = list(Observation.SYMPTOM_CODES.values())
+    patient_ids = []
+    with transaction.atomic():
+        for i in range(patients):
+            patient = Patient.objects.create(
+                identifier=f"{BENCH_PREFIX}{i}",
+                gender='female',
+                birth_date=date(1995, 1, 1)
+            )
+            patient_ids.append(patient.id)
+
+    now = timezone.now()
+    start = time.perf_counter()
+    created = 0
+    while created < rows:
+        batch = []
+        for _ in range(min(batch_size, rows - created)):
+            code, display = random.choice(codes)
+            batch.append(Observation(
+                id=uuid.uuid4(),
+                patient_id=random.choice(patient_ids),
+                status='final',
+                code=code,
+                code_display=display,
+                value_quantity=random.randint(0, 10),
+                value_unit='1-10',
+                effective_date_time=now - timedelta(minutes=random.randint(0, 60 * 24 * 365))
+            ))
+        with transaction.atomic():
+            Observation.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+        print(f"  seeded {created}/{rows} ({created / (time.perf_counter() - start):.0f} rows/s)", end='\r')
+    print()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE postpartum_api_observation')
+
+
+def bench_queries():
+    patient = Patient.objects.filter(identifier__startswith=BENCH_PREFIX).order_by('?').first()
+    end = timezone.now()
+    start = end - timedelta(days=7)
+    code = Observation.SYMPTOM_CODES['headache'][0]
+    return {
+        'date range (ObservationViewSet)': Observation.objects.filter(
+            patient=patient, effective_date_time__gte=start, effective_date_time__lte=end
+        ).order_by('effective_date_time', 'id'),
+        'code + date range': Observation.objects.filter(
+            patient=patient, code=code, effective_date_time__gte=start
+        ).order_by('effective_date_time'),
+    }
+
+
+def measure(queryset, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        list(queryset.all())
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def report(label, runs):
+    print(f"\n=== {label} ===")
+    for name, queryset in bench_queries().items():
+        p50, p99 = measure(queryset, runs)
+        print(f"\n-- {name}: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+        print(queryset.explain())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--cleanup', action='store_true')
+    args = parser.parse_args()
+
+    if args.cleanup:
+        deleted, _ = Patient.objects.filter(identifier__startswith=BENCH_PREFIX).delete()
+        print(f"Deleted {deleted} rows")
+        return
+
+    if not args.skip_seed:
+        print(f"Seeding {args.rows} observations for {args.patients} patients...")
+        seed(args.rows, args.patients, args.batch_size)
+
+    # drop the composite indexes for the "before" numbers and put them back after
+    indexes = Observation._meta.indexes
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.remove_index(Observation, index)
+    try:
+        report('without composite indexes', args.runs)
+    finally:
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Observation, index)
+    report('with composite indexes', args.runs)
+
+
+if __name__ == '__main__':
+    main()
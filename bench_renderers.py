@@ -0,0 +1,76 @@
+"""
+Benchmark for JSON rendering of large observation lists.
+
+Compares DRF's stock JSONRenderer (stdlib json, strings formatted in Python)
+with FastJSONRenderer on orjson and on its stdlib fallback (raw UUIDs and
+datetimes handed to the encoder). No database access is needed.
+
+    python bench_renderers.py --rows 100000 --repeat 5
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "postpartum_project.settings")
+django.setup()
+
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from postpartum_api.renderers import FastJSONRenderer, orjson
+
+
+def observations(rows, raw):
+    patient_id = uuid.uuid4()
+    now = timezone.now()
+    for i in range(rows):
+        observation_id = uuid.uuid4()
+        effective = now - timedelta(minutes=i)
+        yield {
+            "resourceType": "Observation",
+            "id": observation_id if raw else str(observation_id),
+            "status": "final",
+            "code": {"coding": [{"code": "25064002", "display": "Headache"}]},
+            "subject": {"reference": f"Patient/{patient_id}"},
+            "effectiveDateTime": effective if raw else effective.isoformat(),
+            "valueQuantity": {"value": float(i % 10), "unit": "1-10"}
+        }
+
+
+def timed(label, data, repeat, renderer):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = renderer.render(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<22} {best * 1000:8.1f} ms  {len(data) / best:10.0f} rows/s  {len(body) / best / 1e6:7.1f} MB/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    formatted = list(observations(args.rows, raw=False))
+    raw = list(observations(args.rows, raw=True))
+
+    print(f"Observation list ({args.rows} rows)")
+    baseline = timed('drf JSONRenderer', formatted, args.repeat, JSONRenderer())
+    with override_settings(USE_ORJSON=False):
+        timed('fast (stdlib fallback)', raw, args.repeat, FastJSONRenderer())
+    if orjson is not None:
+        fast = timed('fast (orjson)', raw, args.repeat, FastJSONRenderer())
+        print(f"  speedup vs drf         {baseline / fast:.1f}x")
+    else:
+        print("  orjson is not installed")
+
+
+if __name__ == '__main__':
+    main()
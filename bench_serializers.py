@@ -0,0 +1,88 @@
+"""
+Micro-benchmark for the FHIR read serializers.
+
+Seeds a throwaway patient with observations and questionnaire responses
+(10k rows by default) inside a transaction that is rolled back at the end,
+then compares the DRF serializers in serializers.py against the
+.values()-based renderers in fast_serializers.py, including the JSON encoding.
+
+    python bench_serializers.py --rows 10000 --repeat 5
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import date, timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "postpartum_project.settings")
+django.setup()
+
+from django.db import transaction
+from django.utils import timezone
+from postpartum_api.models import Patient, Observation, Questionnaire, QuestionnaireResponse, QuestionnaireResponseItem
+from postpartum_api.serializers import ObservationSerializer, QuestionnaireResponseSerializer
+from postpartum_api.renderers import dumps
+from postpartum_api.fast_serializers import FastObservationSerializer, FastQuestionnaireResponseSerializer
+
+
+def seed(rows):
+    patient = Patient.objects.create(identifier=f"BENCH-{uuid.uuid4().hex[:8]}", gender='female', birth_date=date(1995, 1, 1))
+    questionnaire = Questionnaire.objects.create(
+        identifier=f"BENCH-{uuid.uuid4().hex[:8]}", version='1', name='bench', title='Bench', status='active')
+    code, display = Observation.SYMPTOM_CODES['headache']
+    now = timezone.now()
+    Observation.objects.bulk_create([
+        Observation(patient=patient, status='final', code=code, code_display=display,
+                    value_quantity=i % 10, value_unit='1-10', effective_date_time=now - timedelta(minutes=i))
+        for i in range(rows)
+    ], batch_size=5000)
+    responses = QuestionnaireResponse.objects.bulk_create([
+        QuestionnaireResponse(questionnaire=questionnaire, patient=patient, status='completed')
+        for _ in range(rows)
+    ], batch_size=5000)
+    QuestionnaireResponseItem.objects.bulk_create([
+        QuestionnaireResponseItem(questionnaire_response=r, link_id='mood', text='Mood', answer_integer=3)
+        for r in responses
+    ], batch_size=5000)
+    return patient
+
+
+def timed(label, rows, repeat, render):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<10} {best * 1000:8.1f} ms  {rows / best:10.0f} rows/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with transaction.atomic():
+        patient = seed(args.rows)
+        observations = Observation.objects.filter(patient=patient)
+        responses = QuestionnaireResponse.objects.filter(patient=patient)
+
+        print(f"Observation ({args.rows} rows)")
+        slow = timed('drf', args.rows, args.repeat, lambda: dumps(ObservationSerializer(observations.all(), many=True).data))
+        fast = timed('fast', args.rows, args.repeat, lambda: dumps(FastObservationSerializer.render(FastObservationSerializer.values(observations))))
+        print(f"  speedup    {slow / fast:.1f}x")
+
+        print(f"QuestionnaireResponse ({args.rows} rows)")
+        slow = timed('drf', args.rows, args.repeat, lambda: dumps(QuestionnaireResponseSerializer(responses.prefetch_related('items'), many=True).data))
+        fast = timed('fast', args.rows, args.repeat, lambda: dumps(FastQuestionnaireResponseSerializer.render(FastQuestionnaireResponseSerializer.values(responses))))
+        print(f"  speedup    {slow / fast:.1f}x")
+
+        transaction.set_rollback(True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for loading only the columns the FHIR output needs.
+
+Seeds a throwaway patient with observations carrying long notes (10k rows and
+2 KB of notes by default) inside a transaction that is rolled back at the end,
+then compares loading full model instances, .only() on the serializer's
+read_fields (what the viewsets do now) and .values() rows (the list fast path),
+printing the time and the peak Python memory for each.
+
+    python bench_sparse_fields.py --rows 10000 --notes 2048 --repeat 5
+"""
+import argparse
+import os
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "postpartum_project.settings")
+django.setup()
+
+from django.db import transaction
+from django.utils import timezone
+from postpartum_api.models import Patient, Observation
+from postpartum_api.serializers import ObservationSerializer
+from postpartum_api.fast_serializers import FastObservationSerializer
+
+
+def seed(rows, notes):
+    patient = Patient.objects.create(identifier=f"BENCH-{uuid.uuid4().hex[:8]}", gender='female', birth_date=date(1995, 1, 1))
+    code, display = Observation.SYMPTOM_CODES['headache']
+    now = timezone.now()
+    Observation.objects.bulk_create([
+        Observation(patient=patient, status='final', code=code, code_display=display, notes='n' * notes,
+                    value_quantity=i % 10, value_unit='1-10', effective_date_time=now - timedelta(minutes=i))
+        for i in range(rows)
+    ], batch_size=5000)
+    return patient
+
+
+def measure(label, rows, repeat, load):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    loaded = load()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del loaded
+    print(f"  {label:<8} {best * 1000:8.1f} ms  {rows / best:10.0f} rows/s  peak {peak / 2**20:7.1f} MB")
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--notes', type=int, default=2048, help='characters of notes per row')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with transaction.atomic():
+        patient = seed(args.rows, args.notes)
+        observations = Observation.objects.filter(patient=patient)
+
+        print(f"Observation ({args.rows} rows, {args.notes} chars of notes each)")
+        full = measure('full', args.rows, args.repeat, lambda: list(observations.all()))
+        only = measure('only', args.rows, args.repeat, lambda: list(observations.only(*ObservationSerializer.read_fields)))
+        values = measure('values', args.rows, args.repeat, lambda: list(FastObservationSerializer.values(observations)))
+        for label, (elapsed, peak) in (('only', only), ('values', values)):
+            print(f"  {label:<8} {full[0] / elapsed:.1f}x faster, {full[1] / peak:.1f}x less memory than full rows")
+
+        transaction.set_rollback(True)
+
+
+if __name__ == '__main__':
+    main()
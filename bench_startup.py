@@ -0,0 +1,112 @@
+"""
+Startup benchmark: import time and time to first request.
+
+Runs `python -X importtime manage.py check` a few times and prints the median
+total import time with the slowest top-level imports, then starts gunicorn
+with one worker and times how long it takes to answer its first request.
+
+    python bench_startup.py --runs 5
+    python bench_startup.py --skip-server        # import time only
+    python bench_startup.py --url /api/login/ --port 8050
+
+DJANGO_SETTINGS_MODULE and DATABASE_URL are passed through, so the same
+settings as the deployment are measured. Compare a venv built from
+requirements.txt with one built from requirements-dev.txt to see what the
+extra packages cost.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+# (cumulative microseconds, module) for the top-level imports of one run
+def import_times(command):
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + command,
+                            capture_output=True, text=True, env=os.environ.copy())
+    if result.returncode != 0:
+        sys.exit(f"{' '.join(command)} failed:\n{result.stderr[-2000:]}")
+    modules = []
+    for match in LINE.finditer(result.stderr):
+        self_us, cumulative, indent, module = match.groups()
+        if not indent:
+            modules.append((int(cumulative), module))
+    return modules
+
+
+def measure_imports(runs, top):
+    totals = []
+    slowest = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        modules = import_times(['manage.py', 'check'])
+        wall = time.perf_counter() - start
+        totals.append((sum(cumulative for cumulative, module in modules) / 1e6, wall))
+        for cumulative, module in modules:
+            slowest.setdefault(module, []).append(cumulative)
+
+    print(f"manage.py check ({runs} runs)")
+    print(f"  imports  {statistics.median(t for t, wall in totals) * 1000:8.1f} ms")
+    print(f"  wall     {statistics.median(wall for t, wall in totals) * 1000:8.1f} ms")
+    print(f"  slowest top-level imports")
+    ranked = sorted(((statistics.median(times), module) for module, times in slowest.items()), reverse=True)
+    for cumulative, module in ranked[:top]:
+        print(f"    {cumulative / 1000:8.1f} ms  {module}")
+
+
+# seconds from starting gunicorn to its first response
+def first_request(port, url, timeout):
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'postpartum_project.wsgi:application', '-w', '1', '-b', f'127.0.0.1:{port}'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=os.environ.copy())
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                sys.exit(f"gunicorn exited with {server.returncode}, is it installed (pip install -r requirements.txt)?")
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}{url}', timeout=timeout)
+                return time.perf_counter() - start
+            except urllib.error.HTTPError:
+                # any response counts, the app is up
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        return None
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--skip-server', action='store_true')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--url', default='/api/login/')
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "postpartum_project.settings")
+    measure_imports(args.runs, args.top)
+
+    if args.skip_server:
+        return
+    times = [first_request(args.port, args.url, args.timeout) for _ in range(args.runs)]
+    if None in times:
+        sys.exit(f"gunicorn didn't answer {args.url} within {args.timeout}s")
+    print(f"gunicorn first response ({args.runs} runs)")
+    print(f"  median   {statistics.median(times) * 1000:8.1f} ms")
+    print(f"  min      {min(times) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@
    # exit on error
    set -o errexit
 
+   # server dependencies only, gunicorn is pinned there too
    pip install -r requirements.txt
-   pip install gunicorn
    python manage.py collectstatic --no-input
    python manage.py migrate
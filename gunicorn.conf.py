@@ -0,0 +1,10 @@
+# picked up automatically by gunicorn from the working directory
+
+
+# write out queued provenance rows before a worker exits
+# and stop sending subscription notifications, unsent ones stay queued in the database
+def worker_exit(server, worker):
+    from postpartum_api.audit import provenance_writer
+    from postpartum_api.subscriptions import dispatcher
+    provenance_writer.stop()
+    dispatcher.stop()
@@ -1,4 +1,17 @@
 from django.contrib import admin
+from .models import Subscription, SubscriptionDelivery
 
 # Register your models here.
 
+
+@admin.register(Subscription)
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_display = ['criteria', 'endpoint', 'status', 'updated_at']
+    list_filter = ['status']
+
+
+@admin.register(SubscriptionDelivery)
+class SubscriptionDeliveryAdmin(admin.ModelAdmin):
+    list_display = ['observation', 'subscription', 'status', 'attempts', 'next_attempt_at', 'last_error']
+    list_filter = ['status']
+    raw_id_fields = ['observation', 'subscription']
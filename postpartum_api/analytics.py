@@ -0,0 +1,121 @@
+from datetime import date, datetime
+from django.db import connection
+from django.db.models import Avg, Count, Max, Sum
+from django.db.models.functions import TruncDay, TruncWeek
+from django.utils.dateparse import parse_datetime
+from .models import Observation, DailySymptomSummary
+
+BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+}
+
+# SNOMED code -> display name
+CODE_DISPLAY = dict(Observation.SYMPTOM_CODES.values())
+
+
+# ORDER BY/frame for "this bucket and the 6 days before it", per database
+def rolling_window():
+    if connection.vendor == 'postgresql':
+        return "ORDER BY bucket RANGE BETWEEN INTERVAL '6 days' PRECEDING AND CURRENT ROW"
+    if connection.vendor == 'sqlite':
+        return "ORDER BY julianday(bucket) RANGE BETWEEN 6 PRECEDING AND CURRENT ROW"
+    # no date ranges in the frame, assume one bucket per day
+    return "ORDER BY bucket ROWS BETWEEN 6 PRECEDING AND CURRENT ROW"
+
+
+def bucket_date(value):
+    if isinstance(value, str):
+        value = parse_datetime(value) or date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat()
+
+
+# per-code daily/weekly mean, max, count and rolling 7-day mean, all computed in SQL
+# returns one set of columnar arrays per code
+def symptom_trends(patient_id, bucket='day', codes=None, start=None, end=None):
+    queryset = Observation.objects.filter(patient_id=patient_id)
+    if codes:
+        queryset = queryset.filter(code__in=codes)
+    if start:
+        queryset = queryset.filter(effective_date_time__gte=start)
+    if end:
+        queryset = queryset.filter(effective_date_time__lte=end)
+
+    grouped = (
+        queryset.annotate(bucket=BUCKETS[bucket]('effective_date_time'))
+        .values('code', 'bucket')
+        .annotate(mean_value=Avg('value_quantity'), max_value=Max('value_quantity'),
+                  n=Count('id'), total=Sum('value_quantity'))
+        .order_by()
+    )
+
+    # window functions over the grouped rows, weighted by each bucket's count
+    inner_sql, params = grouped.query.sql_with_params()
+    sql = (
+        "SELECT code, bucket, mean_value, max_value, n, "
+        "SUM(total) OVER w * 1.0 / SUM(n) OVER w "
+        f"FROM ({inner_sql}) buckets "
+        f"WINDOW w AS (PARTITION BY code {rolling_window()}) "
+        "ORDER BY code, bucket"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    series = {}
+    for code, day, mean, maximum, count, rolling in rows:
+        if code not in series:
+            series[code] = {
+                "code": code,
+                "display": CODE_DISPLAY.get(code, code),
+                "date": [], "mean": [], "max": [], "count": [], "rolling7Mean": []
+            }
+        columns = series[code]
+        columns["date"].append(bucket_date(day))
+        columns["mean"].append(round(mean, 2))
+        columns["max"].append(maximum)
+        columns["count"].append(count)
+        columns["rolling7Mean"].append(round(rolling, 2))
+
+    return {
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "bucket": bucket,
+        "series": list(series.values())
+    }
+
+
+# cohort-wide daily figures per code, read from the rollup table instead of observations
+def cohort_symptom_summary(codes=None, start=None, end=None):
+    queryset = DailySymptomSummary.objects.all()
+    if codes:
+        queryset = queryset.filter(code__in=codes)
+    if start:
+        queryset = queryset.filter(day__gte=start)
+    if end:
+        queryset = queryset.filter(day__lte=end)
+
+    rows = (
+        queryset.values('code', 'day')
+        .annotate(patients=Count('patient_id'), n=Sum('count'), total=Sum('total'), max_value=Max('max_value'))
+        .order_by('code', 'day')
+    )
+
+    series = {}
+    for row in rows:
+        code = row['code']
+        if code not in series:
+            series[code] = {
+                "code": code,
+                "display": CODE_DISPLAY.get(code, code),
+                "date": [], "patients": [], "count": [], "mean": [], "max": []
+            }
+        columns = series[code]
+        columns["date"].append(bucket_date(row['day']))
+        columns["patients"].append(row['patients'])
+        columns["count"].append(row['n'])
+        columns["mean"].append(round(row['total'] / row['n'], 2))
+        columns["max"].append(row['max_value'])
+
+    return {"bucket": "day", "series": list(series.values())}
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PostpartumApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'postpartum_api'
+
+    def ready(self):
+        # registers the cache invalidation receivers
+        from . import signals
@@ -0,0 +1,214 @@
+import asyncio
+import base64
+import functools
+import uuid
+from asgiref.sync import sync_to_async
+from django.contrib.auth import alogin
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.views.decorators.http import require_GET
+from django.utils.dateparse import parse_datetime
+from .models import Patient, Observation, QuestionnaireResponse
+from .fast_serializers import FastPatientSerializer, FastObservationSerializer, FastQuestionnaireResponseSerializer
+from .authentication import aauthenticate_token
+from .renderers import dumps
+from .search import date_range
+from .events import event_backend, replay_events
+
+# async versions of the busiest read endpoints, for serving under ASGI (uvicorn workers)
+# they use the async ORM all the way through, so a worker can hold many requests
+# waiting on the database at once. token auth only, DRF views stay on /api/
+
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(dumps(data), status=status, content_type='application/json', headers=headers)
+
+
+def token_required(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        cached = await aauthenticate_token(request)
+        if cached is None:
+            return json_response({'detail': 'Invalid or missing token.'}, status=401,
+                                 headers={'WWW-Authenticate': 'Token'})
+        token, request.user, request.patient = cached
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+# EventSource can't send an Authorization header but does send cookies,
+# so the stream also takes the session a Google sign in leaves behind
+def token_or_session_required(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        cached = await aauthenticate_token(request)
+        if cached is not None:
+            token, request.user, request.patient = cached
+        else:
+            request.user = await request.auser()
+            if not request.user.is_authenticated:
+                return json_response({'detail': 'Invalid or missing token.'}, status=401,
+                                     headers={'WWW-Authenticate': 'Token'})
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def page_size(request):
+    try:
+        return min(max(int(request.GET.get('_count', 100)), 1), 1000)
+    except ValueError:
+        return 100
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(f'{value.isoformat()}|{pk}'.encode('utf-8')).decode('ascii')
+
+
+# (value, id) or None for anything that isn't one of our cursors
+def decode_cursor(cursor):
+    try:
+        value, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        pk = uuid.UUID(pk)
+        value = parse_datetime(value)
+    except ValueError:
+        return None
+    return (value, pk) if value else None
+
+
+# forward-only keyset page as a searchset bundle, ordered by (field, id) like the DRF cursor pagination
+async def keyset_bundle(request, queryset, serializer, field):
+    if request.GET.get('cursor'):
+        position = decode_cursor(request.GET['cursor'])
+        if position is None:
+            return json_response({'detail': 'Invalid cursor'}, status=400)
+        value, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}))
+
+    size = page_size(request)
+    rows = [row async for row in serializer.values(queryset.order_by(field, 'id'))[:size + 1].aiterator()]
+    links = [{"relation": "self", "url": request.build_absolute_uri()}]
+    if len(rows) > size:
+        rows = rows[:size]
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor(rows[-1][field], rows[-1]['id'])
+        links.append({"relation": "next", "url": f"{request.build_absolute_uri(request.path)}?{params.urlencode()}"})
+
+    if hasattr(serializer, 'arender'):
+        resources = await serializer.arender(rows)
+    else:
+        resources = serializer.render(rows)
+    return json_response({
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "link": links,
+        "entry": [{
+            "fullUrl": f"{resource['resourceType']}/{resource['id']}",
+            "resource": resource
+        } for resource in resources]
+    })
+
+
+@require_GET
+@token_required
+async def observation_list(request):
+    queryset = Observation.objects.filter(patient_id=request.patient.id if request.patient else None)
+    start, end, error = date_range(request.GET)
+    if error:
+        return json_response({'detail': error}, status=400)
+    if start:
+        queryset = queryset.filter(effective_date_time__gte=start)
+    if end:
+        queryset = queryset.filter(effective_date_time__lte=end)
+    return await keyset_bundle(request, queryset, FastObservationSerializer, 'effective_date_time')
+
+
+@require_GET
+@token_required
+async def patient_detail(request, pk):
+    row = await FastPatientSerializer.values(Patient.objects.filter(pk=pk, user_id=request.user.id)).afirst()
+    if row is None:
+        return json_response({'detail': 'Not found.'}, status=404)
+    return json_response(FastPatientSerializer.to_representation(row))
+
+
+@require_GET
+@token_required
+async def questionnaire_response_list(request):
+    queryset = QuestionnaireResponse.objects.filter(patient_id=request.patient.id if request.patient else None)
+    return await keyset_bundle(request, queryset, FastQuestionnaireResponseSerializer, 'authored')
+
+
+# seconds between keep-alive comments, proxies drop connections idle for ~60s
+HEARTBEAT = 15
+
+
+def sse(event):
+    return b'id: %s\nevent: %s\ndata: %s\n\n' % (event['id'].encode('utf-8'), event['event'].encode('utf-8'), dumps(event['data']))
+
+
+async def event_stream(patient_id, last_event_id):
+    async with event_backend().subscribe(patient_id) as subscription:
+        # subscribed before replaying, so nothing saved in between is missed
+        yield b'retry: 3000\n\n'
+        sent = set()
+        if last_event_id:
+            events, truncated = await replay_events(patient_id, last_event_id)
+            if truncated:
+                # too far behind to replay, the client refetches the list instead
+                yield b'event: reset\ndata: {}\n\n'
+            for event in events:
+                sent.add(event['id'])
+                yield sse(event)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b': keep-alive\n\n'
+                continue
+            if event is None:
+                # fell behind, closing makes the client reconnect with Last-Event-ID
+                return
+            if event['id'] not in sent:
+                yield sse(event)
+
+
+# Server-Sent Events with the patient's new Observation and QuestionnaireResponse resources
+# an open connection costs a queue and a coroutine, serve it from asgi.py
+# under WSGI (gunicorn's sync workers) the stream would hold a worker for as long as
+# the client stays connected, so it's refused there, see the README for the ASGI command
+@require_GET
+@token_or_session_required
+async def observation_stream(request, pk):
+    if not isinstance(request, ASGIRequest):
+        return json_response({'detail': 'Streaming is only available when served from asgi.py.'}, status=501)
+    if not await Patient.objects.filter(pk=pk, user_id=request.user.id).aexists():
+        return json_response({'detail': 'Not found.'}, status=404)
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('lastEventId')
+    response = StreamingHttpResponse(event_stream(pk, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # keeps nginx style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Google callback for ASGI deployments, set GOOGLE_OAUTH2_REDIRECT_URI to this url
+# the calls to Google don't hold up the event loop while they wait
+@require_GET
+async def google_callback(request):
+    code = request.GET.get('code')
+    if not code:
+        return redirect('/api/login/')
+    # imported on first use, like the sync callback
+    from .google_oauth import agoogle_sign_in, user_for_claims
+    try:
+        claims = await agoogle_sign_in(code, await request.session.apop('oauth_nonce', None))
+        user, token = await sync_to_async(user_for_claims)(claims)
+        await alogin(request, user)
+        return redirect(f'/api/test/?token={token.key}')
+    except Exception as e:
+        # same as the sync callback, a failed sign in goes back to the login page
+        print(f"Error in google_callback: {str(e)}")
+        return redirect('/api/login/')
@@ -0,0 +1,102 @@
+import atexit
+import logging
+import queue
+import threading
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from .models import Provenance
+
+logger = logging.getLogger(__name__)
+
+# provenance rows from the API are queued and written by a background thread
+# in batches, so a write request doesn't wait on its audit insert
+# the queue is bounded (PROVENANCE_QUEUE_SIZE), once it's full rows are written
+# inline by the request so memory stays flat under load. rows still queued when a
+# worker is killed outright are lost, PROVENANCE_ASYNC = False writes them inline (durable mode)
+
+
+class ProvenanceWriter:
+    def __init__(self, batch_size=500, wait=0.2, max_size=10000):
+        self.batch_size = batch_size
+        self.wait = wait  # seconds to wait for more rows before writing a partial batch
+        self.queue = queue.Queue(maxsize=max_size)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='provenance-writer', daemon=True)
+                self.thread.start()
+
+    def put(self, provenances):
+        self.start()
+        overflow = []
+        for provenance in provenances:
+            try:
+                self.queue.put_nowait(provenance)
+            except queue.Full:
+                overflow.append(provenance)
+        if overflow:
+            # the writer is behind, this request writes its own rows
+            Provenance.objects.bulk_create(overflow)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=self.wait)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self.write(batch)
+            for _ in range(len(batch) + stop):
+                self.queue.task_done()
+            if stop:
+                break
+        connection.close()
+
+    def write(self, batch):
+        close_old_connections()
+        try:
+            Provenance.objects.bulk_create(batch)
+        except Exception:
+            # one bad row (say its observation was deleted meanwhile) shouldn't lose the rest
+            logger.exception('provenance batch failed, retrying row by row')
+            for provenance in batch:
+                try:
+                    provenance.save(force_insert=True)
+                except Exception:
+                    logger.exception('dropped provenance %s for %s', provenance.action, provenance.user_id)
+
+    # blocks until everything queued so far is written
+    def flush(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    # writes what's left and stops the thread, for worker shutdown
+    def stop(self, timeout=30):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+
+provenance_writer = ProvenanceWriter(max_size=getattr(settings, 'PROVENANCE_QUEUE_SIZE', 10000))
+atexit.register(provenance_writer.stop)
+
+
+def record_provenance(provenances):
+    if not getattr(settings, 'PROVENANCE_ASYNC', True):
+        Provenance.objects.bulk_create(provenances)
+        return
+    # queued once the write commits, a rolled back write leaves no audit rows
+    transaction.on_commit(lambda: provenance_writer.put(provenances))
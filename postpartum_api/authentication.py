@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from .models import Patient
+
+
+# small in-process LRU with a TTL, one per worker
+# signals clear entries in this process, the TTL bounds how long other workers can lag
+class TokenCache:
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def discard_user(self, user_id):
+        with self.lock:
+            for key in [k for k, (expires, value) in self.entries.items() if value[1].pk == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(
+    getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    getattr(settings, 'TOKEN_CACHE_TIMEOUT', 60)
+)
+
+
+# TokenAuthentication that remembers token -> (token, user, patient)
+# and puts the patient on request.patient
+class CachingTokenAuthentication(TokenAuthentication):
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            request.patient = self.patient
+        return result
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed('Invalid token.')
+            if not token.user.is_active:
+                raise AuthenticationFailed('User inactive or deleted.')
+            patient = Patient.objects.filter(user=token.user).first()
+            cached = (token, token.user, patient)
+            token_cache.set(key, cached)
+
+        token, user, self.patient = cached
+        return (user, token)
+
+
+# async views can't go through DRF, this is the same lookup on the async ORM
+# sharing the same cache, returns (token, user, patient) or None
+async def aauthenticate_token(request):
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) != 2 or parts[0] != 'Token':
+        return None
+    key = parts[1]
+    cached = token_cache.get(key)
+    if cached is None:
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            return None
+        if not token.user.is_active:
+            return None
+        patient = await Patient.objects.filter(user=token.user).afirst()
+        cached = (token, token.user, patient)
+        token_cache.set(key, cached)
+    return cached
+
+
+# the logged in user's patient, looked up at most once per request
+# token requests already have it from CachingTokenAuthentication, session and
+# OAuth requests look it up here the first time it's needed
+def current_patient_or_none(request):
+    if not hasattr(request, 'patient'):
+        request.patient = Patient.objects.filter(user=request.user).first()
+    return request.patient
+
+
+def current_patient(request):
+    patient = current_patient_or_none(request)
+    if patient is None:
+        raise Patient.DoesNotExist('No patient for this user')
+    return patient
+
+
+# for filtering on the patient_id column instead of joining through auth_user
+def current_patient_id(request):
+    patient = current_patient_or_none(request)
+    return patient.id if patient else None
@@ -0,0 +1,247 @@
+import uuid
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .models import Observation, Questionnaire, QuestionnaireResponse, QuestionnaireResponseItem, Provenance
+from .serializers import ObservationSerializer, ANSWER_FIELDS
+from .caching import invalidate_timeline
+from .rollups import refresh_rollups, rollup_key
+from .events import publish_created
+from .subscriptions import notify_subscriptions
+
+# rows per INSERT when writing bundles
+BATCH_SIZE = 1000
+
+# FHIR answer key -> model column
+ANSWER_COLUMNS = {key: field for field, key, convert in ANSWER_FIELDS}
+
+
+# turns a FHIR Observation into the fields ObservationSerializer takes
+def observation_data_from_fhir(resource):
+    data = {}
+
+    data['status'] = resource.get('status', 'final')
+
+    # get just first category
+    if resource.get('category'):
+        categories = resource.get('category', [{}])
+        if len(categories) > 0:
+            codings = categories[0].get('coding', [{}])
+            if len(codings) > 0:
+                data['category'] = codings[0].get('code', '')
+    else:
+        # only vital-signs is supported, same as the model default
+        data['category'] = 'vital-signs'
+
+    # get code and display name
+    if resource.get('code'):
+        code_info = resource.get('code', {})
+        codings = code_info.get('coding', [])
+        if len(codings) > 0:
+            data['code'] = codings[0].get('code', '')
+            data['code_display'] = codings[0].get('display', '')
+    else:
+        data['code'] = ''
+        data['code_display'] = ''
+
+    # get severthy number
+    if resource.get('valueQuantity'):
+        value_info = resource.get('valueQuantity', {})
+        data['value_quantity'] = value_info.get('value')
+        data['value_unit'] = value_info.get('unit')
+
+    data['effective_date_time'] = resource.get('effectiveDateTime', timezone.now())
+
+    # notes as part of observation model, currentlh not implemented in user interface tho, perhaps for next development?
+    if resource.get('note'):
+        notes = resource.get('note', [])
+        if len(notes) > 0:
+            data['notes'] = notes[0].get('text', '')
+    else:
+        data['notes'] = ''
+
+    return data
+
+
+def operation_outcome(*messages):
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": "error", "code": "invalid", "diagnostics": message} for message in messages]
+    }
+
+
+# id part of a "Questionnaire/<id>" reference
+def questionnaire_reference_id(resource):
+    reference = resource.get('questionnaire', '')
+    if isinstance(reference, dict):
+        reference = reference.get('reference', '')
+    return str(reference).split('/')[-1]
+
+
+# serializer errors as "field: message" strings for OperationOutcome diagnostics
+def error_messages(errors):
+    return [f"{field}: {message}" for field, messages in errors.items() for message in messages]
+
+
+# checks a FHIR Observation, returns an unsaved Observation or raises ValidationError
+def build_observation(resource, patient_id):
+    try:
+        data = observation_data_from_fhir(resource)
+    except (AttributeError, TypeError, IndexError):
+        # say category or note given as a string instead of a list of objects
+        raise ValidationError("Malformed Observation")
+    serializer = ObservationSerializer(data=data)
+    if not serializer.is_valid():
+        raise ValidationError(error_messages(serializer.errors))
+    return Observation(patient_id=patient_id, **serializer.validated_data)
+
+
+# checks a FHIR QuestionnaireResponse, returns (response, items) unsaved
+def build_questionnaire_response(resource, patient_id, questionnaire_ids):
+    try:
+        return questionnaire_response_from_fhir(resource, patient_id, questionnaire_ids)
+    except (AttributeError, TypeError, IndexError):
+        raise ValidationError("Malformed QuestionnaireResponse")
+
+
+def questionnaire_response_from_fhir(resource, patient_id, questionnaire_ids):
+    questionnaire_id = questionnaire_reference_id(resource)
+    if questionnaire_id not in questionnaire_ids:
+        raise ValidationError(f"Unknown questionnaire: {questionnaire_id}")
+
+    response = QuestionnaireResponse(
+        questionnaire_id=questionnaire_ids[questionnaire_id],
+        patient_id=patient_id,
+        status=resource.get('status', 'completed')
+    )
+    response.clean_fields(exclude=['questionnaire', 'patient'])
+
+    items = []
+    for item_data in resource.get('item', []):
+        item = QuestionnaireResponseItem(
+            questionnaire_response=response,
+            link_id=item_data.get('linkId', ''),
+            text=item_data.get('text', '')
+        )
+        for answer in item_data.get('answer', [])[:1]:
+            for key, value in answer.items():
+                if key in ANSWER_COLUMNS:
+                    field = ANSWER_COLUMNS[key]
+                    setattr(item, field, item._meta.get_field(field).to_python(value))
+        item.clean_fields(exclude=['questionnaire_response'])
+        items.append(item)
+
+    return response, items
+
+
+# questionnaires referenced by a set of resources, looked up in one query
+def lookup_questionnaires(resources):
+    references = set()
+    for resource in resources:
+        if resource.get('resourceType') == 'QuestionnaireResponse':
+            references.add(questionnaire_reference_id(resource))
+    valid = [reference for reference in references if is_uuid(reference)]
+    if not valid:
+        return {}
+    return {
+        str(pk): pk for pk in Questionnaire.objects.filter(id__in=valid).values_list('id', flat=True)
+    }
+
+
+# bulk inserts new rows plus a create provenance row for each
+# callers wrap this in a transaction. live events and subscriptions are left to
+# process_bundle, so NDJSON imports don't go out as events
+def save_created(observations, responses, items, reason, skip_observations=False):
+    if not skip_observations:
+        Observation.objects.bulk_create(observations, batch_size=BATCH_SIZE)
+    QuestionnaireResponse.objects.bulk_create(responses, batch_size=BATCH_SIZE)
+    QuestionnaireResponseItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+    Provenance.objects.bulk_create(
+        [Provenance(observation=o, user_id=o.patient_id, action='create', reason=reason) for o in observations] +
+        [Provenance(questionnaire_response=r, user_id=r.patient_id, action='create', reason=reason) for r in responses],
+        batch_size=BATCH_SIZE
+    )
+    refresh_rollups([rollup_key(o) for o in observations])
+    # bulk_create doesn't send post_save
+    invalidate_timeline(*[o.patient_id for o in observations])
+
+
+# validates and saves the entries of a transaction or batch bundle
+# returns (response bundle, http status)
+def process_bundle(bundle, patient):
+    if not isinstance(bundle, dict):
+        return operation_outcome("Expected a Bundle"), 400
+    bundle_type = bundle.get('type')
+    if bundle.get('resourceType') != 'Bundle' or bundle_type not in ('transaction', 'batch'):
+        return operation_outcome("Expected a Bundle of type transaction or batch"), 400
+
+    entries = bundle.get('entry', [])
+    if not isinstance(entries, list):
+        return operation_outcome("Bundle.entry must be a list"), 400
+
+    questionnaire_ids = lookup_questionnaires(
+        entry['resource'] for entry in entries if isinstance(entry, dict) and isinstance(entry.get('resource'), dict))
+
+    # one pass to validate every entry
+    observations, responses, items = [], [], []
+    results = []
+    errors = []
+    for index, entry in enumerate(entries):
+        try:
+            if not isinstance(entry, dict):
+                raise ValidationError("entry must be an object")
+            resource = entry.get('resource') or {}
+            request = entry.get('request') or {}
+            if not isinstance(resource, dict) or not isinstance(request, dict):
+                raise ValidationError("entry.resource and entry.request must be objects")
+            method = request.get('method', 'POST')
+            resource_type = resource.get('resourceType')
+            if method != 'POST':
+                raise ValidationError(f"Only POST entries are supported, got {method}")
+            if resource_type == 'Observation':
+                created = build_observation(resource, patient.id)
+                observations.append(created)
+            elif resource_type == 'QuestionnaireResponse':
+                created, response_items = build_questionnaire_response(resource, patient.id, questionnaire_ids)
+                responses.append(created)
+                items.extend(response_items)
+            else:
+                raise ValidationError(f"Unsupported resourceType: {resource_type}")
+            results.append(created)
+        except ValidationError as e:
+            message = f"entry[{index}]: {'; '.join(e.messages)}"
+            errors.append(message)
+            results.append(message)
+
+    # a transaction is all or nothing
+    if bundle_type == 'transaction' and errors:
+        return operation_outcome(*errors), 400
+
+    with transaction.atomic():
+        save_created(observations, responses, items, 'Created via bundle')
+        notify_subscriptions(observations)
+        publish_created(observations + responses)
+
+    response_entries = []
+    for result in results:
+        if isinstance(result, str):
+            response_entries.append({"response": {"status": "400 Bad Request", "outcome": operation_outcome(result)}})
+        else:
+            response_entries.append({"response": {
+                "status": "201 Created",
+                "location": f"{type(result).__name__}/{result.id}"
+            }})
+
+    return {
+        "resourceType": "Bundle",
+        "type": f"{bundle_type}-response",
+        "entry": response_entries
+    }, 200
+
+
+def is_uuid(value):
+    try:
+        uuid.UUID(value)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,48 @@
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# per-patient observation timeline cache
+# every patient has a version token that is replaced whenever one of their
+# observations changes, cached pages and ETags are keyed on that token
+
+
+def timeline_cache():
+    return caches[getattr(settings, 'TIMELINE_CACHE_ALIAS', 'default')]
+
+
+def timeline_cache_enabled():
+    return getattr(settings, 'TIMELINE_CACHE_ENABLED', True)
+
+
+def timeline_version(patient_id):
+    return timeline_cache().get_or_set(f'timeline-version:{patient_id}', uuid.uuid4().hex, None)
+
+
+# called on every observation write, including bulk_create paths that skip signals
+# runs again after commit so a page cached mid-transaction doesn't stick around
+def invalidate_timeline(*patient_ids):
+    keys = [f'timeline-version:{patient_id}' for patient_id in set(patient_ids)]
+    if keys:
+        timeline_cache().delete_many(keys)
+        transaction.on_commit(lambda: timeline_cache().delete_many(keys))
+
+
+def timeline_etag(patient_id, full_path):
+    digest = hashlib.md5(f'{timeline_version(patient_id)}:{full_path}'.encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+
+def get_cached_timeline(patient_id, etag):
+    return timeline_cache().get(f'timeline:{patient_id}:{etag}')
+
+
+def set_cached_timeline(patient_id, etag, data):
+    timeline_cache().set(f'timeline:{patient_id}:{etag}', data, getattr(settings, 'TIMELINE_CACHE_TIMEOUT', 3600))
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match', '')
+    return header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')]
@@ -0,0 +1,71 @@
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+from .serializers import version_id
+
+# ETag/Last-Modified validators and If-None-Match/If-Modified-Since handling
+
+
+def validator_headers(etag, last_modified):
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return headers
+
+
+# returns a 304 if the client's copy is still current, otherwise None
+def not_modified(request, etag, last_modified):
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified is not None else None
+    )
+    if response is not None:
+        for header, value in validator_headers(etag, last_modified).items():
+            response[header] = value
+    return response
+
+
+# ETag for a list from one MAX/COUNT query, before the rows are fetched
+# lists get no Last-Modified: deleting a row doesn't move MAX(updated_at), only the count
+# in the ETag notices, so If-Modified-Since would keep serving 304 for a deleted row
+def list_etag(request, queryset, updated_field='updated_at'):
+    summary = queryset.order_by().aggregate(last_modified=Max(updated_field), total=Count('pk'))
+    last_modified = summary['last_modified']
+    key = f"{summary['total']}:{last_modified.isoformat() if last_modified else ''}:{request.get_full_path()}"
+    return f'W/"{hashlib.md5(key.encode("utf-8")).hexdigest()}"'
+
+
+# runs render() only when the client doesn't already have the current list
+def conditional_list(request, queryset, render, updated_field='updated_at'):
+    etag = list_etag(request, queryset, updated_field)
+    response = not_modified(request, etag, None)
+    if response is not None:
+        return response
+    response = render()
+    response['ETag'] = etag
+    return response
+
+
+class ConditionalGetMixin:
+    updated_field = 'updated_at'
+
+    def list(self, request, *args, **kwargs):
+        return conditional_list(
+            request,
+            self.filter_queryset(self.get_queryset()),
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+            self.updated_field
+        )
+
+    # single resources use the FHIR weak ETag W/"<versionId>"
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        last_modified = getattr(instance, self.updated_field)
+        etag = f'W/"{version_id(last_modified)}"'
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        return Response(self.get_serializer(instance).data, headers=validator_headers(etag, last_modified))
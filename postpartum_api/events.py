@@ -0,0 +1,234 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+from .models import Observation, QuestionnaireResponse
+from .fast_serializers import FastObservationSerializer, FastQuestionnaireResponseSerializer
+
+# live feed of newly created resources per patient, for the SSE stream in async_views
+# writers publish (kind, patient, ids) once their transaction commits, the backend
+# renders the rows once per process and hands them to every open stream of that patient
+
+logger = logging.getLogger(__name__)
+
+KINDS = {
+    'Observation': (Observation, FastObservationSerializer),
+    'QuestionnaireResponse': (QuestionnaireResponse, FastQuestionnaireResponseSerializer),
+}
+# events a slow stream may have queued before it's dropped, the client resumes with Last-Event-ID
+MAX_PENDING = 1000
+# oldest events sent on resume per kind, past that the client gets a reset and refetches
+REPLAY_LIMIT = 500
+
+
+# created_at/kind/id, so replay can find everything after it
+def event_id(kind, row):
+    return f"{row['created_at'].isoformat()}/{kind}/{row['id']}"
+
+
+def parse_event_id(value):
+    try:
+        created_at, kind, pk = value.split('/')
+    except ValueError:
+        return None
+    created_at = parse_datetime(created_at)
+    if created_at is None or kind not in KINDS:
+        return None
+    return created_at, kind, pk
+
+
+def events_from_rows(kind, rows, serializer_rows):
+    return [{"id": event_id(kind, row), "event": kind, "data": resource}
+            for row, resource in zip(rows, serializer_rows)]
+
+
+def render_events(kind, ids):
+    model, serializer = KINDS[kind]
+    rows = list(model.objects.filter(id__in=ids).order_by('created_at', 'id').values(*serializer.fields, 'created_at'))
+    return events_from_rows(kind, rows, serializer.render(rows))
+
+
+# events after a Last-Event-ID, and whether some were left out
+async def replay_events(patient_id, last_event_id):
+    position = parse_event_id(last_event_id)
+    if position is None:
+        return [], True
+    created_at, kind, pk = position
+    events, truncated = [], False
+    for name, (model, serializer) in KINDS.items():
+        queryset = model.objects.filter(patient_id=patient_id, created_at__gte=created_at).order_by('created_at', 'id')
+        rows = [row async for row in queryset.values(*serializer.fields, 'created_at')[:REPLAY_LIMIT + 1].aiterator()]
+        truncated = truncated or len(rows) > REPLAY_LIMIT
+        # same timestamp: order by kind, then id, like the ids sort
+        rows = [row for row in rows[:REPLAY_LIMIT] if (row['created_at'], name, str(row['id'])) > (created_at, kind, pk)]
+        if hasattr(serializer, 'arender'):
+            resources = await serializer.arender(rows)
+        else:
+            resources = serializer.render(rows)
+        events += events_from_rows(name, rows, resources)
+    events.sort(key=lambda event: parse_event_id(event['id']))
+    return events, truncated
+
+
+# one open stream's queue, filled from whichever thread publishes
+class EventSubscription:
+    def __init__(self, backend, patient_id):
+        self.backend = backend
+        self.patient_id = str(patient_id)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # the loop is gone, the stream is closing
+            pass
+
+    def _put(self, event):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= MAX_PENDING:
+            self.overflowed = True
+            event = None
+        self.queue.put_nowait(event)
+
+    # next event, None once the stream fell too far behind
+    async def get(self):
+        return await self.queue.get()
+
+    async def __aenter__(self):
+        self.backend.add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.backend.remove(self)
+
+
+# fans events out to the streams open in this process, enough for a single worker
+class LocalEventBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, patient_id):
+        return EventSubscription(self, patient_id)
+
+    def add(self, subscription):
+        with self.lock:
+            self.subscriptions[subscription.patient_id].add(subscription)
+
+    def remove(self, subscription):
+        with self.lock:
+            self.subscriptions[subscription.patient_id].discard(subscription)
+            if not self.subscriptions[subscription.patient_id]:
+                del self.subscriptions[subscription.patient_id]
+
+    def listeners(self, patient_id):
+        with self.lock:
+            return list(self.subscriptions.get(str(patient_id), ()))
+
+    def publish(self, kind, patient_id, ids):
+        self.deliver(kind, patient_id, ids)
+
+    # rendered only if someone here is listening
+    def deliver(self, kind, patient_id, ids):
+        subscriptions = self.listeners(patient_id)
+        if not subscriptions:
+            return
+        for event in render_events(kind, ids):
+            for subscription in subscriptions:
+                subscription.put(event)
+
+
+# PostgreSQL LISTEN/NOTIFY, so a write in any worker reaches the streams in every worker
+# each process that has open streams keeps one extra connection listening
+class PostgresEventBackend(LocalEventBackend):
+    channel = 'postpartum_events'
+    # notify payloads are capped at 8000 bytes
+    ids_per_notify = 100
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def publish(self, kind, patient_id, ids):
+        ids = [str(pk) for pk in ids]
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), self.ids_per_notify):
+                payload = json.dumps({'kind': kind, 'patient': str(patient_id), 'ids': ids[start:start + self.ids_per_notify]})
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def add(self, subscription):
+        super().add(subscription)
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='event-listener', daemon=True)
+                self.listener.start()
+
+    def listen(self):
+        while True:
+            try:
+                self.listen_once()
+            except Exception:
+                logger.exception("event listener lost its connection, reconnecting")
+                time.sleep(1)
+
+    def listen_once(self):
+        import psycopg2
+        listen_connection = psycopg2.connect(**connection.get_connection_params())
+        listen_connection.autocommit = True
+        try:
+            with listen_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.channel}')
+            while True:
+                if select.select([listen_connection], [], [], 30) == ([], [], []):
+                    continue
+                listen_connection.poll()
+                while listen_connection.notifies:
+                    payload = json.loads(listen_connection.notifies.pop(0).payload)
+                    close_old_connections()
+                    self.deliver(payload['kind'], payload['patient'], payload['ids'])
+        finally:
+            listen_connection.close()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# EVENT_BACKEND, or LISTEN/NOTIFY on PostgreSQL and in-process otherwise
+def event_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            path = getattr(settings, 'EVENT_BACKEND', '')
+            if not path:
+                path = 'postpartum_api.events.PostgresEventBackend' if connection.vendor == 'postgresql' \
+                    else 'postpartum_api.events.LocalEventBackend'
+            _backend = import_string(path)()
+    return _backend
+
+
+def publish_events(groups):
+    backend = event_backend()
+    for (kind, patient_id), ids in groups.items():
+        backend.publish(kind, patient_id, ids)
+
+
+# called wherever observations and questionnaire responses are created,
+# bulk_create paths included, the events go out once the transaction commits
+def publish_created(instances):
+    groups = defaultdict(list)
+    for instance in instances:
+        groups[(type(instance).__name__, instance.patient_id)].append(instance.pk)
+    if groups:
+        transaction.on_commit(lambda: publish_events(groups), robust=True)
@@ -0,0 +1,26 @@
+from .models import Patient, Observation, QuestionnaireResponse, Provenance
+from .renderers import dumps
+from .fast_serializers import FastPatientSerializer, FastObservationSerializer, FastQuestionnaireResponseSerializer, FastProvenanceSerializer
+
+# rows fetched per round trip from the server-side cursor
+CHUNK_SIZE = 2000
+
+# resource type -> (model, renderer, column used for _since)
+EXPORT_TYPES = {
+    'Patient': (Patient, FastPatientSerializer, 'updated_at'),
+    'Observation': (Observation, FastObservationSerializer, 'updated_at'),
+    'QuestionnaireResponse': (QuestionnaireResponse, FastQuestionnaireResponseSerializer, 'updated_at'),
+    'Provenance': (Provenance, FastProvenanceSerializer, 'recorded_at'),
+}
+
+
+# yields one FHIR resource per line for each type, streaming rows from the database
+def export_ndjson(types, since=None):
+    for resource_type in types:
+        model, serializer_class, since_field = EXPORT_TYPES[resource_type]
+        queryset = model.objects.all()
+        if since:
+            queryset = queryset.filter(**{f'{since_field}__gte': since})
+
+        for resource in serializer_class.iter_rendered(queryset, CHUNK_SIZE):
+            yield dumps(resource) + b'\n'
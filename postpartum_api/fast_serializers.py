@@ -0,0 +1,219 @@
+from collections import defaultdict
+from itertools import islice
+from .models import QuestionnaireResponseItem
+from .serializers import version_id
+
+# read-only FHIR renderers that work on .values() rows instead of model instances
+# ids, dates and decimals are left as python objects for renderers.dumps to format,
+# the JSON it produces matches the to_representation of the classes in serializers.py
+
+
+def resource_meta(updated):
+    return {"versionId": version_id(updated), "lastUpdated": updated}
+
+
+# marks a resource that's missing elements on purpose
+SUBSETTED = {"system": "http://terminology.hl7.org/CodeSystem/v3-ObservationValue", "code": "SUBSETTED"}
+
+
+class FastSerializer:
+    fields = ()
+    # FHIR element -> columns it's built from, for _elements
+    element_fields = {}
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.fields)
+
+    @classmethod
+    def render(cls, rows):
+        return [cls.to_representation(row) for row in rows]
+
+    # renders a queryset in chunks so large exports use constant memory
+    @classmethod
+    def iter_rendered(cls, queryset, chunk_size=2000):
+        rows = cls.values(queryset).iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield from cls.render(chunk)
+
+    # selects only the columns behind the requested elements, plus any the caller needs (sort keys)
+    @classmethod
+    def element_values(cls, queryset, elements, extra=()):
+        fields = ['id', 'updated_at']
+        for field in [field for element in elements for field in cls.element_fields[element]] + list(extra):
+            if field not in fields:
+                fields.append(field)
+        return queryset.values(*fields)
+
+    # only the requested elements plus the mandatory id and meta
+    @classmethod
+    def render_elements(cls, rows, elements):
+        keep = {'resourceType', 'id', 'meta', *elements}
+        resources = []
+        for row in rows:
+            full = cls.to_representation(defaultdict(lambda: None, row))
+            resource = {key: value for key, value in full.items() if key in keep}
+            resource['meta'] = dict(resource['meta'], tag=[SUBSETTED])
+            resources.append(resource)
+        return resources
+
+
+class FastPatientSerializer(FastSerializer):
+    fields = ('id', 'identifier', 'active', 'name_last', 'name_first', 'gender', 'birth_date', 'updated_at')
+
+    @staticmethod
+    def to_representation(row):
+        return {
+            "resourceType": "Patient",
+            "id": row['id'],
+            "meta": resource_meta(row['updated_at']),
+            "identifier": [{"value": row['identifier']}],
+            "active": row['active'],
+            "name": [{"family": row['name_last'], "given": [row['name_first']]}],
+            "gender": row['gender'],
+            "birthDate": row['birth_date']
+        }
+
+
+class FastObservationSerializer(FastSerializer):
+    fields = ('id', 'patient_id', 'status', 'code', 'code_display',
+              'effective_date_time', 'value_quantity', 'value_unit', 'updated_at')
+    element_fields = {
+        'status': ('status',),
+        'code': ('code', 'code_display'),
+        'subject': ('patient_id',),
+        'effectiveDateTime': ('effective_date_time',),
+        'valueQuantity': ('value_quantity', 'value_unit'),
+    }
+
+    @staticmethod
+    def to_representation(row):
+        return {
+            "resourceType": "Observation",
+            "id": row['id'],
+            "meta": resource_meta(row['updated_at']),
+            "status": row['status'],
+            "code": {
+                "coding": [{
+                    "code": row['code'],
+                    "display": row['code_display']
+                }]
+            },
+            "subject": {"reference": f"Patient/{row['patient_id']}"},
+            "effectiveDateTime": row['effective_date_time'],
+            "valueQuantity": {
+                "value": row['value_quantity'],
+                "unit": row['value_unit']
+            }
+        }
+
+
+class FastQuestionnaireSerializer(FastSerializer):
+    fields = ('id', 'name', 'title', 'status', 'description', 'updated_at')
+    element_fields = {
+        'name': ('name',),
+        'title': ('title',),
+        'status': ('status',),
+        'description': ('description',),
+    }
+
+    @staticmethod
+    def to_representation(row):
+        return {
+            "resourceType": "Questionnaire",
+            "id": row['id'],
+            "meta": resource_meta(row['updated_at']),
+            "name": row['name'],
+            "title": row['title'],
+            "status": row['status'],
+            "description": row['description']
+        }
+
+
+# item columns, answers checked in the same order as serializers.ANSWER_FIELDS
+ITEM_FIELDS = ('questionnaire_response_id', 'link_id', 'text', 'answer_boolean', 'answer_decimal',
+               'answer_integer', 'answer_string', 'answer_date', 'answer_datetime')
+
+
+class FastQuestionnaireResponseSerializer(FastSerializer):
+    fields = ('id', 'questionnaire_id', 'patient_id', 'authored', 'updated_at')
+
+    @staticmethod
+    def items_of(rows):
+        return QuestionnaireResponseItem.objects.filter(questionnaire_response_id__in=[row['id'] for row in rows])
+
+    # one query for the items of every response in the page
+    @classmethod
+    def render(cls, rows):
+        return cls.render_with_items(rows, cls.items_of(rows).values_list(*ITEM_FIELDS))
+
+    # same, with the item query run through the async ORM
+    # (values_list().aiterator() runs the query eagerly and fails in async code on Django 5.1)
+    @classmethod
+    async def arender(cls, rows):
+        items = cls.items_of(rows).values(*ITEM_FIELDS)
+        return cls.render_with_items(rows, [tuple(item.values()) async for item in items.aiterator()])
+
+    @classmethod
+    def render_with_items(cls, rows, item_rows):
+        items = {row['id']: [] for row in rows}
+        for response_id, link_id, text, boolean, decimal, integer, string, date, datetime in item_rows:
+            if boolean is not None:
+                answer = [{"valueBoolean": boolean}]
+            elif decimal is not None:
+                answer = [{"valueDecimal": decimal}]
+            elif integer is not None:
+                answer = [{"valueInteger": integer}]
+            elif string is not None:
+                answer = [{"valueString": string}]
+            elif date is not None:
+                answer = [{"valueDate": date}]
+            elif datetime is not None:
+                answer = [{"valueDateTime": datetime}]
+            else:
+                answer = []
+            items[response_id].append({"linkId": link_id, "text": text, "answer": answer})
+
+        return [cls.to_representation(row, items[row['id']]) for row in rows]
+
+    @staticmethod
+    def to_representation(row, items):
+        return {
+            "resourceType": "QuestionnaireResponse",
+            "id": row['id'],
+            "meta": resource_meta(row['updated_at']),
+            "questionnaire": {"reference": f"Questionnaire/{row['questionnaire_id']}"},
+            "subject": {"reference": f"Patient/{row['patient_id']}"},
+            "authored": row['authored'],
+            "item": items
+        }
+
+
+class FastProvenanceSerializer(FastSerializer):
+    fields = ('id', 'observation_id', 'questionnaire_response_id', 'recorded_at', 'user_id', 'action')
+
+    ACTIONS = dict(create="Create", update="Update", delete="Delete")
+
+    @classmethod
+    def to_representation(cls, row):
+        target_reference = None
+        if row['observation_id']:
+            target_reference = f"Observation/{row['observation_id']}"
+        elif row['questionnaire_response_id']:
+            target_reference = f"QuestionnaireResponse/{row['questionnaire_response_id']}"
+
+        return {
+            "resourceType": "Provenance",
+            "id": row['id'],
+            "meta": resource_meta(row['recorded_at']),
+            "recorded": row['recorded_at'],
+            "agent": [{"who": {"reference": f"Patient/{row['user_id']}"}}],
+            "activity": {
+                "code": row['action'],
+                "display": cls.ACTIONS.get(row['action'], row['action'])
+            },
+            "target": [{"reference": target_reference}] if target_reference else []
+        }
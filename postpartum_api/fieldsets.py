@@ -0,0 +1,14 @@
+from rest_framework.permissions import SAFE_METHODS
+
+# reads load only the columns the FHIR output is built from (the serializer's read_fields),
+# so free text like notes and descriptions stays in the database unless it's shown.
+# writes still load whole rows, the serializer saves every field
+
+
+class SparseFieldsMixin:
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        read_fields = getattr(self.get_serializer_class(), 'read_fields', None)
+        if self.request.method in SAFE_METHODS and read_fields:
+            queryset = queryset.only(*read_fields)
+        return queryset
@@ -0,0 +1,160 @@
+import os
+import re
+import threading
+from datetime import datetime
+import jwt
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from rest_framework.authtoken.models import Token
+from .models import Patient
+
+# Google sign in: code exchange and id token checks
+# calls go through one keep-alive session per worker with strict timeouts,
+# the discovery document and signing keys are cached for as long as Google allows
+
+DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+DEFAULT_REDIRECT_URI = 'https://cs6440-healthinform.onrender.com/api/accounts/google/login/callback/'
+# used when a response has no Cache-Control max-age
+DEFAULT_MAX_AGE = 3600
+
+
+class OAuthError(Exception):
+    pass
+
+
+def client_config():
+    client_id = getattr(settings, 'GOOGLE_OAUTH2_CLIENT_ID', os.environ.get('GOOGLE_OAUTH2_CLIENT_ID', ''))
+    client_secret = getattr(settings, 'GOOGLE_OAUTH2_CLIENT_SECRET', os.environ.get('GOOGLE_OAUTH2_CLIENT_SECRET', ''))
+    redirect_uri = getattr(settings, 'GOOGLE_OAUTH2_REDIRECT_URI', os.environ.get('GOOGLE_OAUTH2_REDIRECT_URI', DEFAULT_REDIRECT_URI))
+    return client_id, client_secret, redirect_uri
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+# (connect, read) seconds
+def timeout():
+    return getattr(settings, 'GOOGLE_OAUTH2_TIMEOUT', (3.05, 5))
+
+
+def max_age(response):
+    match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    return int(match.group(1)) if match else DEFAULT_MAX_AGE
+
+
+# a JSON document from Google, cached in the shared cache until it expires
+def cached_document(url, refresh=False):
+    key = f'google-oauth:{url}'
+    document = None if refresh else cache.get(key)
+    if document is None:
+        try:
+            response = http_session().get(url, timeout=timeout())
+            response.raise_for_status()
+            document = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise OAuthError(f'could not fetch {url}: {e}')
+        cache.set(key, document, max_age(response))
+    return document
+
+
+def discovery():
+    return cached_document(getattr(settings, 'GOOGLE_OAUTH2_DISCOVERY_URL', DISCOVERY_URL))
+
+
+def exchange_code(code):
+    client_id, client_secret, redirect_uri = client_config()
+    try:
+        response = http_session().post(discovery()['token_endpoint'], data={
+            'code': code,
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'redirect_uri': redirect_uri,
+            'grant_type': 'authorization_code'
+        }, timeout=timeout())
+    except requests.RequestException as e:
+        raise OAuthError(f'token exchange failed: {e}')
+    if response.status_code != 200:
+        raise OAuthError(f'token endpoint returned {response.status_code}')
+    return response.json()
+
+
+def signing_key(kid):
+    jwks_uri = discovery()['jwks_uri']
+    for refresh in (False, True):
+        # an unknown kid means Google rotated its keys since we cached them
+        for key in cached_document(jwks_uri, refresh=refresh).get('keys', []):
+            if key.get('kid') == kid:
+                return jwt.PyJWK(key).key
+    raise OAuthError(f'unknown signing key {kid}')
+
+
+# checks the id token's signature, audience and issuer, returns its claims
+def verify_id_token(id_token):
+    client_id = client_config()[0]
+    issuer = discovery()['issuer']
+    try:
+        key = signing_key(jwt.get_unverified_header(id_token).get('kid'))
+        # Google issues tokens with and without the scheme
+        return jwt.decode(id_token, key, algorithms=['RS256'], audience=client_id,
+                          issuer=[issuer, issuer.removeprefix('https://')])
+    except jwt.PyJWTError as e:
+        raise OAuthError(f'invalid id token: {e}')
+
+
+# nonce is the one google_login kept in the session, it ties the token to this browser's sign in
+def google_sign_in(code, nonce):
+    token_info = exchange_code(code)
+    if not token_info.get('id_token'):
+        raise OAuthError('no id token in the token response')
+    claims = verify_id_token(token_info['id_token'])
+    if not nonce or claims.get('nonce') != nonce:
+        raise OAuthError('id token nonce does not match the sign in')
+    if claims.get('email_verified') not in (True, 'true'):
+        raise OAuthError('Google account email is not verified')
+    return claims
+
+
+# the same calls on a worker thread, so an async view doesn't block its event loop
+async def agoogle_sign_in(code, nonce):
+    return await sync_to_async(google_sign_in, thread_sensitive=False)(code, nonce)
+
+
+# user, patient record and API token for the signed in Google account
+def user_for_claims(claims):
+    user, created = User.objects.get_or_create(
+        username=claims['email'],
+        defaults={
+            'email': claims['email'],
+            'first_name': claims.get('given_name', ''),
+            'last_name': claims.get('family_name', '')}
+    )
+    Patient.objects.get_or_create(
+        user=user,
+        defaults={
+            'identifier': f"PAT-{user.id}",
+            'name_first': claims.get('given_name', ''),
+            'name_last': claims.get('family_name', ''),
+            'gender': 'unknown',
+            'birth_date': datetime.now().date(),
+            'active': True
+        }
+    )
+    token, created = Token.objects.get_or_create(user=user)
+    return user, token
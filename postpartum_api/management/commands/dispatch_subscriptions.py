@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from postpartum_api.subscriptions import dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Send pending subscription notifications, including retries left by web workers that restarted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='send what is due now and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            sent = 0
+            while True:
+                claimed = dispatcher.dispatch_due()
+                if not claimed:
+                    break
+                sent += claimed
+            self.stdout.write(self.style.SUCCESS(f'{sent} deliveries attempted'))
+            return
+        # keeps going until interrupted, web workers' dispatchers and this one never claim the same rows
+        dispatcher.run()
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from postpartum_api.risk import flag_cohort
+
+
+class Command(BaseCommand):
+    help = 'Flag patients whose recent bleeding, chest pain, sadness or anxiety readings cross the risk rules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='lookback window, defaults to RISK_LOOKBACK_DAYS')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        flags = flag_cohort(lookback_days=options['days'])
+        elapsed = time.perf_counter() - start
+        patients = len({flag[0] for flag in flags})
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(flags)} flags for {patients} patients in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,150 @@
+import csv
+import gzip
+import io
+import json
+import os
+import time
+import uuid
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from postpartum_api.models import Patient, Observation, ImportProgress
+from postpartum_api.bundles import build_observation, build_questionnaire_response, lookup_questionnaires, save_created, is_uuid
+
+# columns written by the COPY path, in table order
+COPY_COLUMNS = ['id', 'patient_id', 'status', 'category', 'code', 'code_display', 'value_quantity',
+                'value_unit', 'effective_date_time', 'created_at', 'updated_at', 'notes']
+
+
+class Command(BaseCommand):
+    help = 'Import FHIR Observation and QuestionnaireResponse resources from NDJSON files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='NDJSON files, optionally .gz')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--copy', action='store_true', help='load observations with PostgreSQL COPY')
+        parser.add_argument('--resume', action='store_true', help='skip lines already committed by an earlier run')
+
+    def handle(self, *args, **options):
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy needs a PostgreSQL database')
+
+        for path in options['paths']:
+            if not os.path.exists(path):
+                raise CommandError(f'{path} does not exist')
+            self.import_file(path, options['batch_size'], options['copy'], options['resume'])
+
+    def import_file(self, path, batch_size, use_copy, resume):
+        # line number of the last committed batch, written in the batch's own transaction
+        # so a crash can't leave rows committed that --resume would load again
+        progress_key = os.path.abspath(path)
+        skip = 0
+        if resume:
+            skip = ImportProgress.objects.filter(path=progress_key).values_list('line', flat=True).first() or 0
+            self.stdout.write(f'{path}: resuming after line {skip}')
+
+        opener = gzip.open if path.endswith('.gz') else open
+        start = time.perf_counter()
+        imported = 0
+        line_number = 0
+        batch = []
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if line_number <= skip or not line.strip():
+                    continue
+                batch.append((line_number, line))
+                if len(batch) >= batch_size:
+                    imported += self.import_batch(batch, use_copy, progress_key)
+                    batch = []
+            if batch:
+                imported += self.import_batch(batch, use_copy, progress_key)
+
+        elapsed = time.perf_counter() - start
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{path}: imported {imported} resources in {elapsed:.1f}s ({rate:.0f} rows/sec)'
+        ))
+
+    # validates and writes one batch of lines in a single transaction
+    def import_batch(self, batch, use_copy, progress_key):
+        resources = []
+        for line_number, line in batch:
+            try:
+                resource = json.loads(line)
+            except ValueError:
+                self.stderr.write(f'line {line_number}: not valid JSON')
+                continue
+            if not isinstance(resource, dict):
+                self.stderr.write(f'line {line_number}: not a JSON object')
+                continue
+            resources.append((line_number, resource))
+
+        patient_ids = {
+            str(pk) for pk in Patient.objects.filter(
+                id__in=[ref for ref in (subject_id(r) for _, r in resources) if ref and is_uuid(ref)]
+            ).values_list('id', flat=True)
+        }
+        questionnaire_ids = lookup_questionnaires(r for _, r in resources)
+
+        observations, responses, items = [], [], []
+        for line_number, resource in resources:
+            patient_id = subject_id(resource)
+            resource_type = resource.get('resourceType')
+            try:
+                if patient_id is None:
+                    raise ValidationError('subject must be a Reference object')
+                if patient_id not in patient_ids:
+                    raise ValidationError(f'Unknown subject: {patient_id}')
+                if resource_type == 'Observation':
+                    created = build_observation(resource, patient_id)
+                    observations.append(created)
+                elif resource_type == 'QuestionnaireResponse':
+                    created, response_items = build_questionnaire_response(resource, patient_id, questionnaire_ids)
+                    responses.append(created)
+                    items.extend(response_items)
+                else:
+                    continue
+                # keep the source id so re-exports line up
+                if is_uuid(str(resource.get('id', ''))):
+                    created.id = uuid.UUID(resource['id'])
+                    if resource_type == 'QuestionnaireResponse':
+                        for item in response_items:
+                            item.questionnaire_response = created
+            except ValidationError as e:
+                self.stderr.write(f"line {line_number}: {'; '.join(e.messages)}")
+
+        with transaction.atomic():
+            if use_copy:
+                copy_observations(observations)
+            save_created(observations, responses, items, 'Imported from NDJSON', skip_observations=use_copy)
+            ImportProgress.objects.update_or_create(path=progress_key, defaults={'line': batch[-1][0]})
+
+        return len(observations) + len(responses)
+
+
+# None when the subject isn't a Reference object
+def subject_id(resource):
+    subject = resource.get('subject') or {}
+    if not isinstance(subject, dict):
+        return None
+    return str(subject.get('reference', '')).split('/')[-1]
+
+
+# streams a batch of observations into the table with COPY
+def copy_observations(observations):
+    now = timezone.now()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for o in observations:
+        writer.writerow([
+            o.id, o.patient_id, o.status, o.category, o.code, o.code_display, o.value_quantity,
+            o.value_unit, o.effective_date_time.isoformat(), now.isoformat(), now.isoformat(),
+            '\\N' if o.notes is None else o.notes
+        ])
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {Observation._meta.db_table} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from postpartum_api.models import Patient
+from postpartum_api.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailySymptomSummary rollup table from observations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='chunks rebuilt at the same time')
+        parser.add_argument('--chunk-size', type=int, default=500, help='patients per chunk')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        chunk_size = options['chunk_size']
+        if workers < 1 or chunk_size < 1:
+            raise CommandError('--workers and --chunk-size must be at least 1')
+        # sqlite locks the whole file on write, so threads would just queue up
+        if connection.vendor == 'sqlite':
+            workers = 1
+
+        patient_ids = list(Patient.objects.order_by('id').values_list('id', flat=True))
+        chunks = [patient_ids[i:i + chunk_size] for i in range(0, len(patient_ids), chunk_size)]
+
+        start = time.perf_counter()
+        if workers == 1:
+            rows = sum(rebuild_rollups(chunk) for chunk in chunks)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                rows = sum(executor.map(self.rebuild_chunk, chunks))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'rebuilt {rows} summary rows for {len(patient_ids)} patients in {len(chunks)} chunks ({elapsed:.1f}s)'
+        ))
+
+    # each thread gets its own connection, close it when the chunk is done
+    def rebuild_chunk(self, patient_ids):
+        try:
+            return rebuild_rollups(patient_ids)
+        finally:
+            connections.close_all()
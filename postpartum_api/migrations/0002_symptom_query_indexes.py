@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postpartum_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='observation',
+            name='value_unit',
+            field=models.CharField(default='0-10', max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['patient', 'effective_date_time'], name='obs_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['patient', 'code', 'effective_date_time'], name='obs_patient_code_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionnaireresponse',
+            index=models.Index(fields=['patient', 'authored'], name='qr_patient_authored_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postpartum_api', '0002_symptom_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySymptomSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50)),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0.0)),
+                ('max_value', models.FloatField(default=0.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_symptom_summaries', to='postpartum_api.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['code', 'day'], name='daily_summary_code_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'code', 'day'), name='daily_summary_unique')],
+            },
+        ),
+    ]
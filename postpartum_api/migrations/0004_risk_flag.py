@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('postpartum_api', '0003_daily_symptom_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiskFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50)),
+                ('rule', models.CharField(choices=[('threshold', 'Threshold'), ('trend', 'Rising trend'), ('persistence', 'Persistent')], max_length=20)),
+                ('value', models.FloatField()),
+                ('observation_count', models.IntegerField()),
+                ('flagged_at', models.DateTimeField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='risk_flags', to='postpartum_api.patient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'code', 'rule'), name='risk_flag_unique')],
+            },
+        ),
+    ]
@@ -76,6 +76,13 @@ class Observation(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     notes = models.TextField(blank=True, null=True) # to implement custom notes for next development?
 
+    class Meta:
+        # matches the per-patient date range filter in ObservationViewSet and code lookups
+        indexes = [
+            models.Index(fields=['patient', 'effective_date_time'], name='obs_patient_date_idx'),
+            models.Index(fields=['patient', 'code', 'effective_date_time'], name='obs_patient_code_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.patient} - {self.code_display}: {self.value_quantity} {self.value_unit}"
 
@@ -115,6 +122,11 @@ class QuestionnaireResponse(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'authored'], name='qr_patient_authored_idx'),
+        ]
+
     def __str__(self):
         return f"{self.patient.identifier} - {self.questionnaire.title}"
 
@@ -147,4 +159,99 @@ class Provenance(models.Model):
     reason = models.TextField(null=True, blank=True)
 
     def __str__(self):
-        return f"{self.action} by {self.user}"
\ No newline at end of file
+        return f"{self.action} by {self.user}"
+
+# one row per patient, symptom and day, kept up to date from Observation writes
+# so cohort dashboards don't have to scan the observation table
+class DailySymptomSummary(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='daily_symptom_summaries')
+    code = models.CharField(max_length=50)
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0.0)  # sum of severities, mean is total / count
+    max_value = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'code', 'day'], name='daily_summary_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['code', 'day'], name='daily_summary_code_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id} {self.code} {self.day}: {self.count}"
+
+# patients whose recent severities tripped a risk rule, replaced on every flag_risks run
+class RiskFlag(models.Model):
+    RULES = [('threshold', 'Threshold'), ('trend', 'Rising trend'), ('persistence', 'Persistent')]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='risk_flags')
+    code = models.CharField(max_length=50)
+    rule = models.CharField(max_length=20, choices=RULES)
+    value = models.FloatField()  # the max severity, slope per day or count that tripped the rule
+    observation_count = models.IntegerField()
+    flagged_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'code', 'rule'], name='risk_flag_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id} {self.code} {self.rule}: {self.value}"
+
+# a downstream system to notify about new observations, like a FHIR rest-hook Subscription
+# criteria: observations with this code (blank for any symptom) at or above min_value
+class Subscription(models.Model):
+    STATUSES = [('requested', 'Requested'), ('active', 'Active'), ('error', 'Error'), ('off', 'Off')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUSES, default='active')
+    reason = models.TextField(blank=True)
+    code = models.CharField(max_length=50, blank=True)
+    min_value = models.FloatField(default=0.0)
+    endpoint = models.URLField()
+    header = models.CharField(max_length=255, blank=True)  # sent with every notification, e.g. "Authorization: Bearer ..."
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # the same criteria as an Observation search
+    @property
+    def criteria(self):
+        code = f'code={self.code}&' if self.code else ''
+        return f'Observation?{code}value-quantity=ge{self.min_value:g}'
+
+    def __str__(self):
+        return f"{self.criteria} -> {self.endpoint}"
+
+# one matching observation waiting to be sent to a subscription, pending rows are the retry queue
+class SubscriptionDelivery(models.Model):
+    STATUSES = [('pending', 'Pending'), ('delivered', 'Delivered'), ('failed', 'Failed')]
+
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='deliveries')
+    observation = models.ForeignKey(Observation, on_delete=models.CASCADE, related_name='subscription_deliveries')
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='delivery_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.observation_id} -> {self.subscription_id}: {self.status}"
+
+# last input line committed by import_fhir_ndjson, saved in the same transaction as the batch
+class ImportProgress(models.Model):
+    path = models.CharField(max_length=500, unique=True)
+    line = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path}: {self.line}"
@@ -0,0 +1,137 @@
+import base64
+import functools
+import json
+import operator
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .search import DEFAULT_ORDERING, invalid, search_ordering
+
+# keyset pagination that returns pages as FHIR searchset bundles
+# the cursor holds every ordering column of the row it stops at, not just the first one
+# like DRF's CursorPagination, so ties on the sort column (status, code) never need an offset
+class BundleCursorPagination(BasePagination):
+    page_size = 100
+    page_size_query_param = '_count'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    ordering = ('id',)
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        size = self.get_page_size(request)
+
+        position, reverse = self.decode_cursor(request, queryset.model)
+        # previous pages are read backwards from the cursor, then flipped
+        ordering = [flip(name) for name in self.ordering] if reverse else list(self.ordering)
+        if position is not None:
+            queryset = queryset.filter(after(position, ordering))
+        rows = list(queryset.order_by(*ordering)[:size + 1])
+
+        more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, more
+        else:
+            self.has_next, self.has_previous = more, position is not None
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(self.get_bundle(data))
+
+    def position(self, row):
+        return [row[name.lstrip('-')] if isinstance(row, dict) else getattr(row, name.lstrip('-')) for name in self.ordering]
+
+    def encode_cursor(self, row, reverse):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in self.position(row)]
+        cursor = base64.urlsafe_b64encode(json.dumps({'p': values, 'r': reverse}).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    # (position, reverse), a cursor from another _sort or a mangled one is a 400
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            values = data['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [model._meta.get_field(name.lstrip('-')).to_python(value) for name, value in zip(self.ordering, values)]
+            return position, bool(data.get('r'))
+        except (ValueError, TypeError, KeyError, DjangoValidationError):
+            raise invalid('Invalid cursor')
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.rows[0], True)
+
+    def get_bundle(self, data):
+        links = [{"relation": "self", "url": self.request.build_absolute_uri()}]
+        next_link = self.get_next_link()
+        if next_link:
+            links.append({"relation": "next", "url": next_link})
+        previous_link = self.get_previous_link()
+        if previous_link:
+            links.append({"relation": "previous", "url": previous_link})
+
+        return {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "link": links,
+            "entry": [{
+                "fullUrl": f"{resource['resourceType']}/{resource['id']}",
+                "resource": resource
+            } for resource in data]
+        }
+
+
+def flip(name):
+    return name[1:] if name.startswith('-') else f'-{name}'
+
+
+# rows that come after position in ordering: (a > x) or (a = x and b > y) or ...
+def after(position, ordering):
+    conditions = []
+    equal = Q()
+    for name, value in zip(ordering, position):
+        field = name.lstrip('-')
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        conditions.append(equal & Q(**{f'{field}__{lookup}': value}))
+        equal &= Q(**{field: value})
+    return functools.reduce(operator.or_, conditions)
+
+# oldest first so the dashboard grid ends on the latest value, id breaks ties
+class ObservationPagination(BundleCursorPagination):
+    ordering = DEFAULT_ORDERING
+
+    # FHIR _sort, checked in search.py
+    def get_ordering(self, request, queryset, view):
+        return search_ordering(request.query_params)
+
+class QuestionnaireResponsePagination(BundleCursorPagination):
+    ordering = ('authored', 'id')
@@ -0,0 +1,113 @@
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Observation, RiskFlag
+
+# per symptom, on the 1-10 severity scale:
+#   threshold: any reading at or above this in the lookback window
+#   slope: severity rising by at least this much per day (least squares)
+#   persistence_level/persistence_count: at least count readings at or above level
+DEFAULT_RISK_RULES = {
+    'bleeding': {'threshold': 8, 'slope': 0.5, 'persistence_level': 6, 'persistence_count': 3},
+    'chest-pain': {'threshold': 7, 'slope': 0.5, 'persistence_level': 5, 'persistence_count': 2},
+    'sadness': {'threshold': 8, 'slope': 0.3, 'persistence_level': 6, 'persistence_count': 5},
+    'anxiety': {'threshold': 8, 'slope': 0.3, 'persistence_level': 6, 'persistence_count': 5},
+}
+
+# readings needed before a slope means anything
+MIN_TREND_POINTS = 3
+
+
+def risk_rules():
+    rules = getattr(settings, 'RISK_RULES', DEFAULT_RISK_RULES)
+    # keyed by SNOMED code like the observations
+    return {Observation.SYMPTOM_CODES[symptom][0]: rule for symptom, rule in rules.items()}
+
+
+# distinct values in first-seen order, plus each item's index into them
+# a dict is much faster than np.unique on an object array of UUIDs
+def factorize(items):
+    index = {}
+    positions = np.fromiter((index.setdefault(item, len(index)) for item in items), dtype=np.int64, count=len(items))
+    return list(index), positions
+
+
+# recent readings as column arrays, no model instances
+def load_columns(codes, since):
+    rows = list(
+        Observation.objects.filter(code__in=codes, effective_date_time__gte=since, value_quantity__isnull=False)
+        .values_list('patient_id', 'code', 'value_quantity', 'effective_date_time')
+        .order_by()
+    )
+    if not rows:
+        return None
+    patient_ids, row_codes, values, times = zip(*rows)
+    patients, patient_index = factorize(patient_ids)
+    code_list, code_index = factorize(row_codes)
+    return (
+        patients, patient_index, code_list, code_index,
+        np.array(values, dtype=float),
+        np.array([t.timestamp() for t in times], dtype=float),
+    )
+
+
+# evaluates every rule for every (patient, code) group at once
+# returns (patient_id, code, rule, value, observation_count) tuples
+def evaluate(patients, patient_index, code_list, code_index, values, timestamps, rules):
+    group_ids, group = np.unique(patient_index * len(code_list) + code_index, return_inverse=True)
+    group_patient = group_ids // len(code_list)
+    group_code = group_ids % len(code_list)
+
+    # per-code rule settings, spread out to rows and groups
+    def setting(name):
+        return np.array([rules[code][name] for code in code_list], dtype=float)
+    threshold = setting('threshold')[group_code]
+    min_slope = setting('slope')[group_code]
+    level = setting('persistence_level')[code_index]
+    min_count = setting('persistence_count')[group_code]
+
+    size = len(group_ids)
+    n = np.bincount(group, minlength=size)
+    peak = np.full(size, -np.inf)
+    np.maximum.at(peak, group, values)
+    persistent = np.bincount(group, weights=values >= level, minlength=size)
+
+    # least squares slope in severity per day, days counted from the newest reading
+    x = (timestamps - timestamps.max()) / 86400.0
+    sx = np.bincount(group, weights=x, minlength=size)
+    sy = np.bincount(group, weights=values, minlength=size)
+    sxy = np.bincount(group, weights=x * values, minlength=size)
+    sxx = np.bincount(group, weights=x * x, minlength=size)
+    denominator = n * sxx - sx * sx
+    fit = (n >= MIN_TREND_POINTS) & (denominator > 1e-9)
+    slope = np.divide(n * sxy - sx * sy, denominator, out=np.zeros(size), where=fit)
+
+    flags = []
+    for rule, hit, value in (
+        ('threshold', peak >= threshold, peak),
+        ('trend', fit & (slope >= min_slope), slope),
+        ('persistence', persistent >= min_count, persistent),
+    ):
+        for g in np.flatnonzero(hit):
+            flags.append((patients[group_patient[g]], code_list[group_code[g]], rule, float(value[g]), int(n[g])))
+    return flags
+
+
+# scans the cohort's recent readings and replaces the flags table
+def flag_cohort(now=None, lookback_days=None):
+    now = now or timezone.now()
+    lookback_days = lookback_days or getattr(settings, 'RISK_LOOKBACK_DAYS', 14)
+    rules = risk_rules()
+    columns = load_columns(list(rules), now - timedelta(days=lookback_days))
+    flags = evaluate(*columns, rules) if columns else []
+
+    with transaction.atomic():
+        RiskFlag.objects.all().delete()
+        RiskFlag.objects.bulk_create([
+            RiskFlag(patient_id=patient_id, code=code, rule=rule, value=value,
+                     observation_count=count, flagged_at=now)
+            for patient_id, code, rule, value, count in flags
+        ], batch_size=1000)
+    return flags
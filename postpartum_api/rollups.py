@@ -0,0 +1,82 @@
+import uuid
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Observation, DailySymptomSummary
+
+
+# (patient, code, day) an observation counts towards
+def rollup_key(observation):
+    return (observation.patient_id, observation.code, timezone.localtime(observation.effective_date_time).date())
+
+
+def grouped_days(queryset):
+    return (
+        queryset.annotate(day=TruncDate('effective_date_time'))
+        .values('patient_id', 'code', 'day')
+        .annotate(count=Count('id'), total=Sum('value_quantity'), max_value=Max('value_quantity'))
+        .order_by()
+    )
+
+
+def save_summaries(rows):
+    DailySymptomSummary.objects.bulk_create(
+        [DailySymptomSummary(updated_at=timezone.now(), **row) for row in rows],
+        update_conflicts=True,
+        unique_fields=['patient', 'code', 'day'],
+        update_fields=['count', 'total', 'max_value', 'updated_at'],
+    )
+
+
+# serializes rollup writers per patient. without it two transactions adding to the same
+# day each count only their own new row under READ COMMITTED, and the later upsert wins.
+# the lock waits for the other writer to commit, so the aggregate after it sees both.
+# a transaction level advisory lock keyed on the patient id, so no extra read of the
+# patient row, taken in key order so writers touching several patients can't deadlock.
+# sqlite only ever has one writer
+def lock_patients(patient_ids):
+    if connection.vendor != 'postgresql' or not patient_ids:
+        return
+    keys = sorted({uuid.UUID(str(pk)).int >> 64 for pk in patient_ids})
+    # bigint is signed
+    keys = [key - (1 << 64) if key >= 1 << 63 else key for key in keys]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(key) FROM unnest(%s::bigint[]) AS key ORDER BY key', [keys])
+
+
+# recomputes the summary rows for the given (patient, code, day) keys
+# from the observations behind them, one aggregate query per patient
+def refresh_rollups(keys):
+    by_patient = defaultdict(set)
+    for patient_id, code, day in keys:
+        by_patient[patient_id].add((code, day))
+
+    with transaction.atomic():
+        lock_patients(by_patient)
+        for patient_id, code_days in by_patient.items():
+            codes = {code for code, day in code_days}
+            days = {day for code, day in code_days}
+            rows = [
+                row for row in grouped_days(Observation.objects.filter(
+                    patient_id=patient_id, code__in=codes, effective_date_time__date__in=days))
+                if (row['code'], row['day']) in code_days
+            ]
+            save_summaries(rows)
+
+            # groups that have no observations left
+            found = {(row['code'], row['day']) for row in rows}
+            for code, day in code_days - found:
+                DailySymptomSummary.objects.filter(patient_id=patient_id, code=code, day=day).delete()
+
+
+# rebuilds every summary row for a set of patients
+def rebuild_rollups(patient_ids, batch_size=5000):
+    with transaction.atomic():
+        lock_patients(patient_ids)
+        DailySymptomSummary.objects.filter(patient_id__in=patient_ids).delete()
+        rows = list(grouped_days(Observation.objects.filter(patient_id__in=patient_ids)))
+        for start in range(0, len(rows), batch_size):
+            save_summaries(rows[start:start + batch_size])
+    return len(rows)
@@ -0,0 +1,158 @@
+import uuid
+from datetime import datetime, time, timedelta
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from .bundles import operation_outcome
+
+# FHIR search parameters for Observation, compiled into one ORM query
+# https://hl7.org/fhir/R4/search.html
+
+PREFIXES = ('eq', 'ne', 'gt', 'lt', 'ge', 'le')
+
+# _sort names -> columns, id always breaks ties and is part of every cursor
+SORT_FIELDS = {
+    'date': 'effective_date_time',
+    'value-quantity': 'value_quantity',
+    'code': 'code',
+    'status': 'status',
+}
+DEFAULT_ORDERING = ('effective_date_time', 'id')
+
+
+def invalid(message):
+    return ValidationError(operation_outcome(message))
+
+
+# parse_datetime returns None for a bad format but raises for out of range values like 2025-13-45
+def parse_when(value):
+    try:
+        when = parse_datetime(value)
+    except ValueError:
+        return None
+    if when is not None and timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+# the start_date/end_date params as aware datetimes, plus an error message for a bad one
+def date_range(params):
+    dates = []
+    for name in ('start_date', 'end_date'):
+        value = params.get(name)
+        when = parse_when(value) if value else None
+        if value and when is None:
+            return None, None, f'Invalid {name}: {value}'
+        dates.append(when)
+    return dates[0], dates[1], None
+
+
+def split_prefix(value):
+    if value[:2] in PREFIXES:
+        return value[:2], value[2:]
+    return 'eq', value
+
+
+# [start, end) covered by a FHIR date, a date means the whole day
+def date_bounds(value):
+    # well formed but out of range values like 2025-13-45 raise instead of returning None
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        raise invalid(f'Invalid date: {value}')
+    if day is not None:
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        return start, start + timedelta(days=1)
+    if moment is None:
+        raise invalid(f'Invalid date: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment, moment + (timedelta(microseconds=1) if moment.microsecond else timedelta(seconds=1))
+
+
+def date_filter(value):
+    prefix, value = split_prefix(value)
+    start, end = date_bounds(value)
+    within = Q(effective_date_time__gte=start, effective_date_time__lt=end)
+    return {
+        'eq': within,
+        'ne': ~within,
+        'gt': Q(effective_date_time__gte=end),
+        'lt': Q(effective_date_time__lt=start),
+        'ge': Q(effective_date_time__gte=start),
+        'le': Q(effective_date_time__lt=end),
+    }[prefix]
+
+
+# value[|system|unit], the unit part is ignored since every symptom uses 1-10
+def quantity_filter(value):
+    prefix, value = split_prefix(value)
+    try:
+        number = float(value.split('|')[0])
+    except ValueError:
+        raise invalid(f'Invalid value-quantity: {value}')
+    if prefix == 'ne':
+        return ~Q(value_quantity=number)
+    lookup = {'eq': 'exact', 'gt': 'gt', 'lt': 'lt', 'ge': 'gte', 'le': 'lte'}[prefix]
+    return Q(**{f'value_quantity__{lookup}': number})
+
+
+def reference_id(value):
+    try:
+        return uuid.UUID(value.split('/')[-1])
+    except ValueError:
+        raise invalid(f'Invalid patient: {value}')
+
+
+def search_observations(queryset, params):
+    # patient/subject only narrow the user's own observations
+    for name in ('patient', 'subject'):
+        if params.get(name):
+            queryset = queryset.filter(patient_id=reference_id(params[name]))
+
+    # token lists are ORed, system|code tokens match on the code
+    if params.get('code'):
+        queryset = queryset.filter(code__in=[token.split('|')[-1] for token in params['code'].split(',')])
+    if params.get('status'):
+        queryset = queryset.filter(status__in=params['status'].split(','))
+
+    # repeated parameters are ANDed, date=ge2025-04-01&date=lt2025-05-01
+    for value in params.getlist('date'):
+        queryset = queryset.filter(date_filter(value))
+    for value in params.getlist('value-quantity'):
+        queryset = queryset.filter(quantity_filter(value))
+    return queryset
+
+
+def search_ordering(params):
+    if not params.get('_sort'):
+        return DEFAULT_ORDERING
+    ordering = []
+    for name in params['_sort'].split(','):
+        descending = name.startswith('-')
+        field = SORT_FIELDS.get(name.lstrip('-'))
+        if field is None:
+            raise invalid(f"Unsupported _sort: {name}, use one of: {', '.join(SORT_FIELDS)}")
+        ordering.append(f'-{field}' if descending else field)
+    ordering.append('-id' if ordering[0].startswith('-') else 'id')
+    return tuple(ordering)
+
+
+def search_summary(params):
+    summary = params.get('_summary', 'false')
+    if summary not in ('count', 'false'):
+        raise invalid(f'Unsupported _summary: {summary}')
+    return summary
+
+
+# requested elements out of a fast serializer's element_fields, None for the whole resource
+def search_elements(params, serializer):
+    if not params.get('_elements'):
+        return None
+    elements = params['_elements'].split(',')
+    unknown = [element for element in elements if element not in serializer.element_fields and element not in ('id', 'meta')]
+    if unknown:
+        raise invalid(f"Unsupported _elements: {', '.join(unknown)}")
+    return [element for element in elements if element in serializer.element_fields]
@@ -2,8 +2,18 @@ from rest_framework import serializers
 from .models import Patient, Observation, Questionnaire, QuestionnaireResponse, QuestionnaireResponseItem, Provenance
 from django.utils import timezone
 
+# FHIR meta.versionId, taken from the last update time in microseconds
+def version_id(updated):
+    return str(int(updated.timestamp() * 1000000))
+
+def resource_meta(updated):
+    return {"versionId": version_id(updated), "lastUpdated": updated.isoformat()}
+
 # Serializer for patients
 class PatientSerializer(serializers.ModelSerializer):
+    # columns to_representation reads, GET requests load only these
+    read_fields = ('id', 'identifier', 'active', 'name_first', 'name_last', 'gender', 'birth_date', 'updated_at')
+
     class Meta:
         model = Patient
         fields = ['id', 'identifier', 'active', 'name_first', 'name_last',
@@ -15,6 +25,7 @@ class PatientSerializer(serializers.ModelSerializer):
         return {
             "resourceType": "Patient",
             "id": str(instance.id),
+            "meta": resource_meta(instance.updated_at),
             "identifier": [{"value": instance.identifier}],
             "active": instance.active,
             "name": [{"family": instance.name_last, "given": [instance.name_first]}],
@@ -25,6 +36,9 @@ class PatientSerializer(serializers.ModelSerializer):
 # Convert symptoms to JSON
 class ObservationSerializer(serializers.ModelSerializer):
     patient = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all(), required=False)
+    # notes and category aren't part of the FHIR output, so reads leave them in the database
+    read_fields = ('id', 'patient_id', 'status', 'code', 'code_display', 'effective_date_time',
+                   'value_quantity', 'value_unit', 'updated_at')
     
     class Meta:
         model = Observation
@@ -50,6 +64,7 @@ class ObservationSerializer(serializers.ModelSerializer):
         return {
             "resourceType": "Observation",
             "id": str(instance.id),
+            "meta": resource_meta(instance.updated_at),
             "status": instance.status,
             "code": {
                 "coding": [{
@@ -57,7 +72,7 @@ class ObservationSerializer(serializers.ModelSerializer):
                     "display": instance.code_display
                 }]
             },
-            "subject": {"reference": f"Patient/{instance.patient.id}"},
+            "subject": {"reference": f"Patient/{instance.patient_id}"},
             "effectiveDateTime": instance.effective_date_time.isoformat(),
             "valueQuantity": {
                 "value": instance.value_quantity,
@@ -66,6 +81,8 @@ class ObservationSerializer(serializers.ModelSerializer):
         }
 
 class QuestionnaireSerializer(serializers.ModelSerializer):
+    read_fields = ('id', 'name', 'title', 'status', 'description', 'updated_at')
+
     class Meta:
         model = Questionnaire
         fields = ['id', 'identifier', 'version', 'name', 'title',
@@ -77,6 +94,7 @@ class QuestionnaireSerializer(serializers.ModelSerializer):
         return {
             "resourceType": "Questionnaire",
             "id": str(instance.id),
+            "meta": resource_meta(instance.updated_at),
             "name": instance.name,
             "title": instance.title,
             "status": instance.status,
@@ -90,8 +108,28 @@ class QuestionnaireResponseItemSerializer(serializers.ModelSerializer):
                  'answer_datetime', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+# answer columns in the order they're checked, with the FHIR key for each
+ANSWER_FIELDS = (
+    ('answer_boolean', 'valueBoolean', None),
+    ('answer_decimal', 'valueDecimal', float),
+    ('answer_integer', 'valueInteger', None),
+    ('answer_string', 'valueString', None),
+    ('answer_date', 'valueDate', lambda value: value.isoformat()),
+    ('answer_datetime', 'valueDateTime', lambda value: value.isoformat()),
+)
+
+def item_answer(item):
+    # first answer column that is set, or empty dict if none
+    for field, key, convert in ANSWER_FIELDS:
+        value = getattr(item, field)
+        if value is not None:
+            return {key: convert(value) if convert else value}
+    return {}
+
 class QuestionnaireResponseSerializer(serializers.ModelSerializer):
     items = QuestionnaireResponseItemSerializer(many=True, read_only=True)
+    read_fields = ('id', 'questionnaire_id', 'patient_id', 'authored', 'updated_at')
+    item_read_fields = ('id', 'questionnaire_response_id', 'link_id', 'text') + tuple(field for field, key, convert in ANSWER_FIELDS)
     
     class Meta:
         model = QuestionnaireResponse
@@ -100,23 +138,10 @@ class QuestionnaireResponseSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'authored', 'created_at', 'updated_at']
     
     def to_representation(self, instance):
-        # gets all items for this respone
+        # gets all items for this respone (uses prefetch_related('items') if the queryset has it)
         items = []
         for item in instance.items.all():
-            answer = {}
-            if item.answer_boolean is not None:
-                answer = {"valueBoolean": item.answer_boolean}
-            elif item.answer_decimal is not None:
-                answer = {"valueDecimal": float(item.answer_decimal)}
-            elif item.answer_integer is not None:
-                answer = {"valueInteger": item.answer_integer}
-            elif item.answer_string is not None:
-                answer = {"valueString": item.answer_string}
-            elif item.answer_date is not None:
-                answer = {"valueDate": item.answer_date.isoformat()}
-            elif item.answer_datetime is not None:
-                answer = {"valueDateTime": item.answer_datetime.isoformat()}
-            
+            answer = item_answer(item)
             items.append({
                 "linkId": item.link_id,
                 "text": item.text,
@@ -126,8 +151,9 @@ class QuestionnaireResponseSerializer(serializers.ModelSerializer):
         return {
             "resourceType": "QuestionnaireResponse",
             "id": str(instance.id),
-            "questionnaire": {"reference": f"Questionnaire/{instance.questionnaire.id}"},
-            "subject": {"reference": f"Patient/{instance.patient.id}"},
+            "meta": resource_meta(instance.updated_at),
+            "questionnaire": {"reference": f"Questionnaire/{instance.questionnaire_id}"},
+            "subject": {"reference": f"Patient/{instance.patient_id}"},
             "authored": instance.authored.isoformat(),
             "item": items
         }
@@ -147,6 +173,8 @@ class QuestionnaireResponseSerializer(serializers.ModelSerializer):
 
 # Keeps track of what changed and who did it
 class ProvenanceSerializer(serializers.ModelSerializer):
+    read_fields = ('id', 'observation_id', 'questionnaire_response_id', 'recorded_at', 'user_id', 'action')
+
     class Meta:
         model = Provenance
         fields = ['id', 'observation', 'questionnaire_response',
@@ -154,17 +182,19 @@ class ProvenanceSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'recorded_at']
     
     def to_representation(self, instance):
+        # fk ids only so rendering doesn't load the related rows
         target_reference = None
-        if instance.observation:
-            target_reference = f"Observation/{instance.observation.id}"
-        elif instance.questionnaire_response:
-            target_reference = f"QuestionnaireResponse/{instance.questionnaire_response.id}"
+        if instance.observation_id:
+            target_reference = f"Observation/{instance.observation_id}"
+        elif instance.questionnaire_response_id:
+            target_reference = f"QuestionnaireResponse/{instance.questionnaire_response_id}"
         
         return {
             "resourceType": "Provenance",
             "id": str(instance.id),
+            "meta": resource_meta(instance.recorded_at),
             "recorded": instance.recorded_at.isoformat(),
-            "agent": [{"who": {"reference": f"Patient/{instance.user.id}"}}],
+            "agent": [{"who": {"reference": f"Patient/{instance.user_id}"}}],
             "activity": {
                 "code": instance.action,
                 "display": dict(
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .models import Patient, Observation
+from .caching import invalidate_timeline
+from .authentication import token_cache
+
+
+@receiver([post_save, post_delete], sender=Observation)
+def observation_changed(sender, instance, **kwargs):
+    invalidate_timeline(instance.patient_id)
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def patient_changed(sender, instance, **kwargs):
+    if instance.user_id:
+        token_cache.discard_user(instance.user_id)
+
+
+# covers deactivation, is_active is checked when the token is looked up again
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    token_cache.discard_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.discard(instance.key)
@@ -0,0 +1,254 @@
+import atexit
+import logging
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+import requests
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from .models import Observation, Subscription, SubscriptionDelivery
+from .fast_serializers import FastObservationSerializer
+from .renderers import dumps
+
+logger = logging.getLogger(__name__)
+
+# notifies downstream systems about new observations that match a Subscription
+# matches are saved as SubscriptionDelivery rows in the same transaction as the
+# observations, then a background dispatcher posts them in batches per subscription
+# from a bounded pool of threads. failed batches are retried with exponential backoff
+# until SUBSCRIPTION_MAX_ATTEMPTS, pending rows survive restarts
+
+# seconds a claimed delivery is hidden from other dispatchers while it's being sent
+# a round can take longer than this, so the dispatcher renews it for the rows it
+# still holds every time a batch finishes and at least every half lease
+LEASE = 60
+
+
+def dispatch_setting(name, default):
+    return getattr(settings, f'SUBSCRIPTION_{name}', default)
+
+
+# one query for the active subscriptions, then every observation is checked in memory
+def match_subscriptions(observations):
+    by_code = defaultdict(list)
+    for subscription in Subscription.objects.filter(status='active'):
+        by_code[subscription.code].append(subscription)
+    if not by_code:
+        return []
+
+    now = timezone.now()
+    deliveries = []
+    for observation in observations:
+        # the instances aren't saved yet, value_quantity is whatever the writer passed in
+        # and a value that can't be compared must never break the write
+        try:
+            value = float(observation.value_quantity)
+        except (TypeError, ValueError):
+            continue
+        for subscription in by_code.get(observation.code, []) + by_code.get('', []):
+            if value >= subscription.min_value:
+                deliveries.append(SubscriptionDelivery(
+                    subscription=subscription, observation=observation, next_attempt_at=now))
+    return deliveries
+
+
+# called wherever observations are created, inside their transaction
+def notify_subscriptions(observations):
+    deliveries = match_subscriptions(observations)
+    if deliveries:
+        SubscriptionDelivery.objects.bulk_create(deliveries)
+        transaction.on_commit(dispatcher.wake)
+
+
+# seconds to wait before the next attempt, doubling each time with some jitter
+def backoff(attempts):
+    base = dispatch_setting('BACKOFF', 10)
+    delay = min(base * 2 ** (attempts - 1), dispatch_setting('MAX_BACKOFF', 3600))
+    return delay * random.uniform(0.8, 1.2)
+
+
+# due deliveries, leased so another worker's dispatcher skips them
+def claim_due(limit):
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(SubscriptionDelivery.objects.select_for_update(skip_locked=True, of=('self',))
+                   .filter(status='pending', next_attempt_at__lte=now, subscription__status='active')
+                   .order_by('next_attempt_at').values_list('id', flat=True)[:limit])
+        SubscriptionDelivery.objects.filter(id__in=ids).update(next_attempt_at=now + timedelta(seconds=LEASE))
+    return list(SubscriptionDelivery.objects.filter(id__in=ids).select_related('subscription'))
+
+
+def renew_lease(ids):
+    SubscriptionDelivery.objects.filter(id__in=ids, status='pending').update(
+        next_attempt_at=timezone.now() + timedelta(seconds=LEASE))
+
+
+# a history Bundle with the matching observations
+def notification(subscription, rows):
+    return {
+        "resourceType": "Bundle",
+        "type": "history",
+        "timestamp": timezone.now(),
+        "entry": [{
+            "fullUrl": f"Observation/{row['id']}",
+            "resource": FastObservationSerializer.to_representation(row),
+            "request": {"method": "POST", "url": "Observation"}
+        } for row in rows]
+    }
+
+
+def headers_for(subscription):
+    headers = {'Content-Type': 'application/fhir+json', 'X-Subscription-Id': str(subscription.id)}
+    if ':' in subscription.header:
+        name, value = subscription.header.split(':', 1)
+        headers[name.strip()] = value.strip()
+    return headers
+
+
+# runs on a pool thread, only does the HTTP call, returns an error message or None
+def post_batch(session, subscription, body):
+    try:
+        response = session.post(subscription.endpoint, data=body, headers=headers_for(subscription),
+                                timeout=dispatch_setting('TIMEOUT', (3.05, 10)))
+    except requests.RequestException as e:
+        return str(e)
+    if not 200 <= response.status_code < 300:
+        return f'{subscription.endpoint} returned {response.status_code}'
+    return None
+
+
+def record_results(results):
+    now = timezone.now()
+    delivered, retried = [], []
+    for deliveries, error in results:
+        for delivery in deliveries:
+            if error is None:
+                delivery.status = 'delivered'
+                delivery.delivered_at = now
+                delivery.last_error = ''
+                delivered.append(delivery)
+                continue
+            delivery.attempts += 1
+            delivery.last_error = error
+            if delivery.attempts >= dispatch_setting('MAX_ATTEMPTS', 8):
+                delivery.status = 'failed'
+            else:
+                delivery.next_attempt_at = now + timedelta(seconds=backoff(delivery.attempts))
+            retried.append(delivery)
+    SubscriptionDelivery.objects.bulk_update(delivered, ['status', 'delivered_at', 'last_error'])
+    SubscriptionDelivery.objects.bulk_update(retried, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+
+
+class SubscriptionDispatcher:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.executor = None
+        self.session = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping = False
+                self.thread = threading.Thread(target=self.run, name='subscription-dispatcher', daemon=True)
+                self.thread.start()
+
+    # new deliveries were committed
+    def wake(self):
+        self.start()
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopping:
+            try:
+                while self.dispatch_due() and not self.stopping:
+                    pass
+                wait = self.seconds_until_due()
+            except Exception:
+                logger.exception('subscription dispatch failed')
+                wait = dispatch_setting('POLL', 30)
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+        connection.close()
+
+    def seconds_until_due(self):
+        next_at = (SubscriptionDelivery.objects.filter(status='pending', subscription__status='active')
+                   .order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first())
+        poll = dispatch_setting('POLL', 30)
+        if next_at is None:
+            return poll
+        return min(max((next_at - timezone.now()).total_seconds(), 0), poll)
+
+    def pool(self):
+        # one keep-alive session and a bounded set of sender threads
+        with self.lock:
+            if self.executor is None:
+                workers = dispatch_setting('WORKERS', 4)
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='subscription-sender')
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+                self.session.mount('https://', adapter)
+                self.session.mount('http://', adapter)
+        return self.executor, self.session
+
+    # sends one round of due deliveries, returns how many were claimed
+    def dispatch_due(self):
+        close_old_connections()
+        batch_size = dispatch_setting('BATCH_SIZE', 50)
+        deliveries = claim_due(dispatch_setting('CLAIM_LIMIT', 1000))
+        if not deliveries:
+            return 0
+
+        rows = {row['id']: row for row in FastObservationSerializer.values(
+            Observation.objects.filter(id__in={delivery.observation_id for delivery in deliveries}))}
+        by_subscription = defaultdict(list)
+        for delivery in deliveries:
+            by_subscription[delivery.subscription_id].append(delivery)
+
+        queued = []
+        for subscription_deliveries in by_subscription.values():
+            subscription = subscription_deliveries[0].subscription
+            # an observation deleted since the claim takes its deliveries with it
+            subscription_deliveries = [delivery for delivery in subscription_deliveries if delivery.observation_id in rows]
+            for start in range(0, len(subscription_deliveries), batch_size):
+                queued.append((subscription, subscription_deliveries[start:start + batch_size]))
+        held = {delivery.id for subscription, batch in queued for delivery in batch}
+
+        # only as many batches in flight as there are senders, the rest wait here still leased
+        executor, session = self.pool()
+        workers = dispatch_setting('WORKERS', 4)
+        in_flight = {}
+        while queued or in_flight:
+            while queued and len(in_flight) < workers:
+                subscription, batch = queued.pop(0)
+                body = dumps(notification(subscription, [rows[delivery.observation_id] for delivery in batch]))
+                in_flight[executor.submit(post_batch, session, subscription, body)] = batch
+            done, _ = wait(in_flight, timeout=LEASE / 2, return_when=FIRST_COMPLETED)
+            results = [(in_flight.pop(future), future.result()) for future in done]
+            record_results(results)
+            for batch, error in results:
+                held.difference_update(delivery.id for delivery in batch)
+            if held:
+                renew_lease(list(held))
+        return len(deliveries)
+
+    # for worker shutdown, pending rows are picked up again later
+    def stop(self, timeout=30):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout)
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+
+dispatcher = SubscriptionDispatcher()
+atexit.register(dispatcher.stop)
@@ -1,3 +1,1441 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .models import (
+    Patient, Observation, Questionnaire, QuestionnaireResponse, QuestionnaireResponseItem, Provenance, DailySymptomSummary,
+    RiskFlag, Subscription, SubscriptionDelivery, ImportProgress
+)
+from .serializers import (
+    PatientSerializer, ObservationSerializer, QuestionnaireSerializer, QuestionnaireResponseSerializer, ProvenanceSerializer
+)
+from .renderers import dumps
+from .bundles import save_created
+from .risk import flag_cohort
+from .audit import ProvenanceWriter, record_provenance
+from .events import event_id
+from .subscriptions import dispatcher, match_subscriptions, renew_lease
+from .fast_serializers import (
+    FastPatientSerializer, FastObservationSerializer, FastQuestionnaireSerializer, FastQuestionnaireResponseSerializer,
+    FastProvenanceSerializer
+)
+
+
+# makes a user with a token and patient record
+def make_patient(username='mom'):
+    user = User.objects.create_user(username=username, password='pass12345')
+    token = Token.objects.create(user=user)
+    patient = Patient.objects.create(
+        user=user,
+        identifier=f"PAT-{user.id}",
+        gender='female',
+        birth_date=date(1995, 1, 1)
+    )
+    return user, token, patient
+
+
+def add_observations(patient, count):
+    code, display = Observation.SYMPTOM_CODES['headache']
+    now = timezone.now()
+    for i in range(count):
+        Observation.objects.create(
+            patient=patient,
+            status='final',
+            code=code,
+            code_display=display,
+            value_quantity=i % 10,
+            effective_date_time=now - timedelta(hours=i)
+        )
+
+
+def add_responses(patient, questionnaire, count):
+    for i in range(count):
+        response = QuestionnaireResponse.objects.create(
+            questionnaire=questionnaire, patient=patient, status='completed')
+        QuestionnaireResponseItem.objects.create(
+            questionnaire_response=response, link_id='mood', text='Mood today', answer_integer=i)
+        QuestionnaireResponseItem.objects.create(
+            questionnaire_response=response, link_id='slept', text='Slept well', answer_boolean=True)
+
+
+# the number of queries for list/detail pages shouldn't grow with the rows
+# (timeline cache off so the list queries actually run)
+@override_settings(TIMELINE_CACHE_ENABLED=False)
+class QueryCountTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.questionnaire = Questionnaire.objects.create(
+            identifier='postpartum-wellness-v1',
+            version='1.0',
+            name='Postpartum Wellness Assessment',
+            title='Postpartum Wellness Questionnaire',
+            status='active'
+        )
+        # first request fills the token cache, the counts below are for later requests
+        self.client.get('/api/patients/')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    # runs the url with 1 row and with many rows and compares
+    def assertConstantQueries(self, url, add_rows):
+        add_rows(1)
+        few = self.count_queries(url)
+        add_rows(25)
+        many = self.count_queries(url)
+        self.assertEqual(few, many, f"{url} ran {few} queries for 1 row but {many} for 26")
+
+    # MAX/COUNT for the ETag, rows
+    def test_patient_list(self):
+        self.assertEqual(self.count_queries('/api/patients/'), 2)
+
+    def test_patient_detail(self):
+        self.assertEqual(self.count_queries(f'/api/patients/{self.patient.id}/'), 1)
+
+    def test_observation_list(self):
+        self.assertConstantQueries(
+            '/api/observations/', lambda n: add_observations(self.patient, n))
+
+    def test_observation_detail(self):
+        add_observations(self.patient, 1)
+        observation = Observation.objects.get()
+        self.assertEqual(self.count_queries(f'/api/observations/{observation.id}/'), 1)
+
+    def test_patient_observations(self):
+        self.assertConstantQueries(
+            f'/api/patients/{self.patient.id}/observations/',
+            lambda n: add_observations(self.patient, n))
+
+    def test_questionnaire_list(self):
+        self.assertEqual(self.count_queries('/api/questionnaires/'), 2)
+
+    def test_questionnaire_detail(self):
+        self.assertEqual(self.count_queries(f'/api/questionnaires/{self.questionnaire.id}/'), 1)
+
+    def test_questionnaire_response_list(self):
+        self.assertConstantQueries(
+            '/api/questionnaire-responses/',
+            lambda n: add_responses(self.patient, self.questionnaire, n))
+
+    def test_questionnaire_response_detail(self):
+        add_responses(self.patient, self.questionnaire, 1)
+        response = QuestionnaireResponse.objects.get()
+        self.assertEqual(self.count_queries(f'/api/questionnaire-responses/{response.id}/'), 2)
+
+    def test_questionnaire_responses(self):
+        self.assertConstantQueries(
+            f'/api/questionnaires/{self.questionnaire.id}/responses/',
+            lambda n: add_responses(self.patient, self.questionnaire, n))
+
+    def test_patient_questionnaire_responses(self):
+        self.assertConstantQueries(
+            f'/api/patients/{self.patient.id}/questionnaire_responses/',
+            lambda n: add_responses(self.patient, self.questionnaire, n))
+
+
+class QuestionnaireResponseRenderTests(TestCase):
+    def test_answer_types(self):
+        user, token, patient = make_patient()
+        questionnaire = Questionnaire.objects.create(
+            identifier='q1', version='1', name='q1', title='Q1', status='active')
+        response = QuestionnaireResponse.objects.create(
+            questionnaire=questionnaire, patient=patient, status='completed')
+        QuestionnaireResponseItem.objects.create(
+            questionnaire_response=response, link_id='a', text='A', answer_decimal='2.50')
+        QuestionnaireResponseItem.objects.create(
+            questionnaire_response=response, link_id='b', text='B', answer_date=date(2025, 4, 1))
+        QuestionnaireResponseItem.objects.create(
+            questionnaire_response=response, link_id='c', text='C')
+
+        response = QuestionnaireResponse.objects.prefetch_related('items').get()
+        data = QuestionnaireResponseSerializer(response).data
+        answers = {item['linkId']: item['answer'] for item in data['item']}
+        self.assertEqual(answers['a'], [{"valueDecimal": 2.5}])
+        self.assertEqual(answers['b'], [{"valueDate": "2025-04-01"}])
+        self.assertEqual(answers['c'], [])
+        self.assertEqual(data['subject'], {"reference": f"Patient/{patient.id}"})
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_observations_come_back_as_bundle_pages(self):
+        add_observations(self.patient, 5)
+        bundle = self.client.get('/api/observations/?_count=2').json()
+        self.assertEqual(bundle['resourceType'], 'Bundle')
+        self.assertEqual(bundle['type'], 'searchset')
+
+        seen = []
+        while True:
+            seen += [entry['resource']['effectiveDateTime'] for entry in bundle['entry']]
+            next_links = [link['url'] for link in bundle['link'] if link['relation'] == 'next']
+            if not next_links:
+                break
+            self.assertLessEqual(len(bundle['entry']), 2)
+            bundle = self.client.get(next_links[0]).json()
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen))
+
+
+# durable mode, so provenance is written inside the request
+@override_settings(PROVENANCE_ASYNC=False)
+class LogSymptomsTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_logs_each_symptom_with_provenance(self):
+        response = self.client.post('/api/symptoms/', {
+            'symptoms': ['headache', 'anxiety', 'not-a-symptom'],
+            'severity': 7
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(set(Observation.objects.values_list('value_quantity', flat=True)), {7})
+        self.assertEqual(Provenance.objects.filter(observation__patient=self.patient).count(), 2)
+
+    def test_per_symptom_severity_and_time(self):
+        response = self.client.post('/api/symptoms/', {
+            'symptoms': [
+                {'symptom': 'bleeding', 'severity': 9, 'effectiveDateTime': '2025-04-01T08:00:00Z'},
+                {'symptom': 'sadness', 'severity': 3},
+            ]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        bleeding = Observation.objects.get(code=Observation.SYMPTOM_CODES['bleeding'][0])
+        sadness = Observation.objects.get(code=Observation.SYMPTOM_CODES['sadness'][0])
+        self.assertEqual(bleeding.value_quantity, 9)
+        self.assertEqual(bleeding.effective_date_time.isoformat(), '2025-04-01T08:00:00+00:00')
+        self.assertEqual(sadness.value_quantity, 3)
+
+    def test_write_count_does_not_grow_with_symptoms(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/api/symptoms/', {
+                'symptoms': list(Observation.SYMPTOM_CODES)
+            }, format='json')
+        self.assertEqual(Observation.objects.count(), len(Observation.SYMPTOM_CODES))
+        # observations, provenance and the daily summary upsert
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_bad_timestamp_saves_nothing(self):
+        response = self.client.post('/api/symptoms/', {
+            'symptoms': ['headache', {'symptom': 'bleeding', 'effectiveDateTime': 'yesterday'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Observation.objects.exists())
+
+    def test_bad_entries_are_400(self):
+        for entry in [{'symptom': 'bleeding', 'severity': 'abc'},
+                      {'symptom': 'bleeding', 'severity': None},
+                      {'symptom': 'bleeding', 'effectiveDateTime': '2025-13-45T00:00:00'},
+                      {'symptom': 'bleeding', 'effectiveDateTime': '2099-01-01T00:00:00Z'}]:
+            response = self.client.post('/api/symptoms/', {'symptoms': ['headache', entry]}, format='json')
+            self.assertEqual(response.status_code, 400, entry)
+        self.assertFalse(Observation.objects.exists())
+
+    def test_string_severity_is_converted(self):
+        response = self.client.post('/api/symptoms/', {'symptoms': ['headache'], 'severity': '7'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Observation.objects.get().value_quantity, 7)
+
+
+def fhir_observation(symptom, severity):
+    code, display = Observation.SYMPTOM_CODES[symptom]
+    return {
+        "resourceType": "Observation",
+        "status": "final",
+        "category": [{"coding": [{"code": "vital-signs"}]}],
+        "code": {"coding": [{"code": code, "display": display}]},
+        "valueQuantity": {"value": severity, "unit": "1-10"},
+        "effectiveDateTime": "2025-04-01T08:00:00Z"
+    }
+
+
+class BundleTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.questionnaire = Questionnaire.objects.create(
+            identifier='q1', version='1', name='q1', title='Q1', status='active')
+
+    def post_bundle(self, bundle_type, resources):
+        return self.client.post('/api/', {
+            "resourceType": "Bundle",
+            "type": bundle_type,
+            "entry": [{"resource": r, "request": {"method": "POST"}} for r in resources]
+        }, format='json')
+
+    def test_transaction_creates_everything(self):
+        response_resource = {
+            "resourceType": "QuestionnaireResponse",
+            "questionnaire": f"Questionnaire/{self.questionnaire.id}",
+            "status": "completed",
+            "item": [{"linkId": "mood", "text": "Mood", "answer": [{"valueInteger": 4}]}]
+        }
+        resources = [fhir_observation('headache', i % 10) for i in range(50)] + [response_resource]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_bundle('transaction', resources)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual(data['type'], 'transaction-response')
+        self.assertEqual(len(data['entry']), 51)
+        self.assertTrue(all(e['response']['status'] == '201 Created' for e in data['entry']))
+        self.assertEqual(Observation.objects.filter(patient=self.patient).count(), 50)
+        self.assertEqual(QuestionnaireResponseItem.objects.get().answer_integer, 4)
+        self.assertEqual(Provenance.objects.count(), 51)
+        self.assertLess(len(ctx.captured_queries), 15)
+
+    def test_transaction_rolls_back_on_bad_entry(self):
+        bad = fhir_observation('headache', 3)
+        bad['code']['coding'][0]['code'] = 'nope'
+        response = self.post_bundle('transaction', [fhir_observation('bleeding', 2), bad])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['resourceType'], 'OperationOutcome')
+        self.assertFalse(Observation.objects.exists())
+
+    def test_batch_keeps_good_entries(self):
+        bad = fhir_observation('headache', 3)
+        bad['code']['coding'][0]['code'] = 'nope'
+        response = self.post_bundle('batch', [fhir_observation('bleeding', 2), bad])
+        self.assertEqual(response.status_code, 200)
+        statuses = [e['response']['status'] for e in response.json()['entry']]
+        self.assertEqual(statuses, ['201 Created', '400 Bad Request'])
+        self.assertEqual(Observation.objects.count(), 1)
+
+    def test_category_is_optional(self):
+        resource = fhir_observation('bleeding', 2)
+        del resource['category']
+        response = self.post_bundle('transaction', [resource])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Observation.objects.get().category, 'vital-signs')
+
+    def test_diagnostics_name_the_field(self):
+        bad = fhir_observation('headache', 3)
+        bad['code']['coding'][0]['code'] = 'nope'
+        diagnostics = self.post_bundle('transaction', [bad]).json()['issue'][0]['diagnostics']
+        self.assertTrue(diagnostics.startswith('entry[0]: code: '), diagnostics)
+        self.assertNotIn('ErrorDetail', diagnostics)
+
+    def test_malformed_entries_are_400(self):
+        for entries in ({}, ['x'], [{"resource": "x"}], [{"resource": {}, "request": []}],
+                        [{"resource": dict(fhir_observation('bleeding', 2), category="x")}]):
+            response = self.client.post('/api/', {"resourceType": "Bundle", "type": "transaction", "entry": entries},
+                                        format='json')
+            self.assertEqual(response.status_code, 400, entries)
+            self.assertEqual(response.json()['resourceType'], 'OperationOutcome')
+
+    def test_rejects_other_bundle_types(self):
+        response = self.post_bundle('collection', [fhir_observation('bleeding', 2)])
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.user.is_staff = True
+        self.user.save()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        add_observations(self.patient, 3)
+
+    def read_lines(self, response):
+        content = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return [json.loads(line) for line in content.decode('utf-8').splitlines()]
+
+    def test_streams_ndjson(self):
+        response = self.client.get('/api/$export?_type=Patient,Observation')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/fhir+ndjson')
+        types = [r['resourceType'] for r in self.read_lines(response)]
+        self.assertEqual(types, ['Patient', 'Observation', 'Observation', 'Observation'])
+
+    def test_gzip_and_since(self):
+        Observation.objects.update(updated_at=timezone.now() - timedelta(days=30))
+        since = (timezone.now() - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        add_observations(self.patient, 1)
+        response = self.client.get(f'/api/$export?_type=Observation&_since={since}', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(self.read_lines(response)), 1)
+
+    def test_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/$export').status_code, 403)
+
+
+class ImportCommandTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.questionnaire = Questionnaire.objects.create(
+            identifier='q1', version='1', name='q1', title='Q1', status='active')
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write_ndjson(self, resources, name='data.ndjson.gz'):
+        path = os.path.join(self.tmpdir, name)
+        with gzip.open(path, 'wt') as f:
+            for resource in resources:
+                f.write(json.dumps(resource) + '\n')
+        return path
+
+    def test_imports_in_batches_and_resumes(self):
+        resources = []
+        for i in range(7):
+            resource = fhir_observation('anxiety', i)
+            resource['subject'] = {"reference": f"Patient/{self.patient.id}"}
+            resources.append(resource)
+        resources.append({
+            "resourceType": "QuestionnaireResponse",
+            "id": "3f1c2a9e-7c43-4f6b-9c55-2d4f7f0d9a11",
+            "subject": {"reference": f"Patient/{self.patient.id}"},
+            "questionnaire": {"reference": f"Questionnaire/{self.questionnaire.id}"},
+            "status": "completed",
+            "item": [{"linkId": "slept", "text": "Slept", "answer": [{"valueBoolean": False}]}]
+        })
+        path = self.write_ndjson(resources)
+
+        call_command('import_fhir_ndjson', path, '--batch-size', '3', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Observation.objects.count(), 7)
+        self.assertEqual(str(QuestionnaireResponse.objects.get().id), "3f1c2a9e-7c43-4f6b-9c55-2d4f7f0d9a11")
+        self.assertFalse(QuestionnaireResponseItem.objects.get().answer_boolean)
+        self.assertEqual(Provenance.objects.count(), 8)
+
+        self.assertEqual(ImportProgress.objects.get(path=os.path.abspath(path)).line, 8)
+
+        # pretend the run stopped after the second batch
+        ImportProgress.objects.filter(path=os.path.abspath(path)).update(line=6)
+        Observation.objects.filter(value_quantity=6).delete()
+        QuestionnaireResponse.objects.all().delete()
+        call_command('import_fhir_ndjson', path, '--resume', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Observation.objects.count(), 7)
+        self.assertEqual(QuestionnaireResponse.objects.count(), 1)
+
+    def test_failed_batch_keeps_progress(self):
+        resources = []
+        for i in range(4):
+            resource = fhir_observation('anxiety', i)
+            resource['subject'] = {"reference": f"Patient/{self.patient.id}"}
+            resources.append(resource)
+        path = self.write_ndjson(resources)
+        # the second batch fails inside its transaction, its progress goes with it
+        calls = []
+
+        def crash_on_second_batch(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError('crash')
+            return save_created(*args, **kwargs)
+        with mock.patch('postpartum_api.management.commands.import_fhir_ndjson.save_created', crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                call_command('import_fhir_ndjson', path, '--batch-size', '2', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(ImportProgress.objects.get().line, 2)
+        self.assertEqual(Observation.objects.count(), 2)
+
+        call_command('import_fhir_ndjson', path, '--batch-size', '2', '--resume', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Observation.objects.count(), 4)
+
+    def test_skips_unknown_subjects(self):
+        resource = fhir_observation('anxiety', 2)
+        resource['subject'] = {"reference": "Patient/not-a-patient"}
+        stderr = io.StringIO()
+        call_command('import_fhir_ndjson', self.write_ndjson([resource]), stdout=io.StringIO(), stderr=stderr)
+        self.assertFalse(Observation.objects.exists())
+        self.assertIn('Unknown subject', stderr.getvalue())
+
+    def test_reports_bad_lines_and_keeps_going(self):
+        good = fhir_observation('anxiety', 2)
+        good['subject'] = {"reference": f"Patient/{self.patient.id}"}
+        odd_subject = dict(good, subject="Patient/x")
+        path = os.path.join(self.tmpdir, 'mixed.ndjson')
+        with open(path, 'w') as f:
+            f.write('\n'.join(['[]', '"x"', json.dumps(odd_subject), json.dumps(good)]) + '\n')
+        stderr = io.StringIO()
+        call_command('import_fhir_ndjson', path, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(Observation.objects.count(), 1)
+        self.assertIn('line 1: not a JSON object', stderr.getvalue())
+        self.assertIn('line 2: not a JSON object', stderr.getvalue())
+        self.assertIn('line 3: subject must be a Reference object', stderr.getvalue())
+
+    def test_round_trips_export(self):
+        self.user.is_staff = True
+        self.user.save()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        add_observations(self.patient, 4)
+        before = sorted(Observation.objects.values_list('id', 'code', 'value_quantity'))
+
+        response = client.get('/api/$export?_type=Observation')
+        path = os.path.join(self.tmpdir, 'export.ndjson')
+        with open(path, 'wb') as f:
+            f.write(b''.join(response.streaming_content))
+        Observation.objects.all().delete()
+
+        stderr = io.StringIO()
+        call_command('import_fhir_ndjson', path, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(stderr.getvalue(), '')
+        self.assertEqual(sorted(Observation.objects.values_list('id', 'code', 'value_quantity')), before)
+
+
+class FastSerializerTests(TestCase):
+    def test_output_matches_model_serializers(self):
+        user, token, patient = make_patient()
+        questionnaire = Questionnaire.objects.create(
+            identifier='q1', version='1', name='q1', title='Q1', status='active')
+        add_observations(patient, 3)
+        add_responses(patient, questionnaire, 2)
+        response = QuestionnaireResponse.objects.first()
+        QuestionnaireResponseItem.objects.create(
+            questionnaire_response=response, link_id='d', text='D', answer_decimal='1.25')
+        QuestionnaireResponseItem.objects.create(
+            questionnaire_response=response, link_id='t', text='T', answer_datetime=timezone.now())
+        Provenance.objects.create(observation=Observation.objects.first(), user=patient, action='create')
+        Provenance.objects.create(questionnaire_response=response, user=patient, action='update')
+
+        pairs = [
+            (Patient.objects.all(), PatientSerializer, FastPatientSerializer),
+            (Observation.objects.all(), ObservationSerializer, FastObservationSerializer),
+            (Questionnaire.objects.all(), QuestionnaireSerializer, FastQuestionnaireSerializer),
+            (QuestionnaireResponse.objects.prefetch_related('items'), QuestionnaireResponseSerializer, FastQuestionnaireResponseSerializer),
+            (Provenance.objects.all(), ProvenanceSerializer, FastProvenanceSerializer),
+        ]
+        for queryset, slow, fast in pairs:
+            queryset = queryset.order_by('pk')
+            expected = dumps(slow(queryset, many=True).data)
+            self.assertEqual(dumps(fast.render(fast.values(queryset))), expected)
+            with self.settings(USE_ORJSON=False):
+                self.assertEqual(dumps(fast.render(fast.values(queryset))), expected)
+
+
+class RendererTests(TestCase):
+    def test_backends_agree(self):
+        data = {
+            "id": uuid.UUID('3f1c2a9e-7c43-4f6b-9c55-2d4f7f0d9a11'),
+            "effectiveDateTime": datetime(2025, 4, 1, 8, 0, 0, 1500, tzinfo=dt_timezone.utc),
+            "birthDate": date(1995, 1, 1),
+            "valueDecimal": Decimal('2.50'),
+            "display": "Café"
+        }
+        expected = (
+            '{"id":"3f1c2a9e-7c43-4f6b-9c55-2d4f7f0d9a11",'
+            '"effectiveDateTime":"2025-04-01T08:00:00.001500+00:00",'
+            '"birthDate":"1995-01-01","valueDecimal":2.5,"display":"Café"}'
+        ).encode('utf-8')
+        self.assertEqual(dumps(data), expected)
+        with self.settings(USE_ORJSON=False):
+            self.assertEqual(dumps(data), expected)
+
+    def test_api_round_trip_without_orjson(self):
+        user, token, patient = make_patient()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with self.settings(USE_ORJSON=False):
+            response = client.post('/api/symptoms/', {'symptoms': ['headache']}, format='json')
+            self.assertEqual(response.status_code, 200)
+            bundle = client.get('/api/observations/').json()
+        self.assertEqual(bundle['entry'][0]['resource']['subject'], {"reference": f"Patient/{patient.id}"})
+
+
+class TimelineCacheTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        add_observations(self.patient, 3)
+
+    def test_unchanged_timeline_is_304(self):
+        first = self.client.get('/api/observations/')
+        etag = first['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get('/api/observations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+        # token, user and patient all come from cache
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_cached_page_skips_query(self):
+        first = self.client.get('/api/observations/')
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get('/api/observations/')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_writes_invalidate(self):
+        etag = self.client.get('/api/observations/')['ETag']
+        observation = Observation.objects.first()
+        observation.value_quantity = 9
+        observation.save()
+        response = self.client.get('/api/observations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.client.post('/api/symptoms/', {'symptoms': ['bleeding']}, format='json')
+        response = self.client.get('/api/observations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['entry']), 4)
+
+    def test_query_params_get_their_own_etag(self):
+        all_rows = self.client.get('/api/observations/')['ETag']
+        some_rows = self.client.get('/api/observations/?_count=1')['ETag']
+        self.assertNotEqual(all_rows, some_rows)
+
+
+@override_settings(TIMELINE_CACHE_ENABLED=False)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        add_observations(self.patient, 3)
+
+    def test_resources_carry_meta(self):
+        observation = Observation.objects.first()
+        data = self.client.get(f'/api/observations/{observation.id}/').json()
+        self.assertEqual(data['meta']['versionId'], str(int(observation.updated_at.timestamp() * 1000000)))
+        self.assertEqual(data['meta']['lastUpdated'], observation.updated_at.isoformat())
+
+    def test_detail_etag_and_last_modified(self):
+        observation = Observation.objects.first()
+        url = f'/api/observations/{observation.id}/'
+        first = self.client.get(url)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        observation.value_quantity = 1
+        observation.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_list_304_skips_row_query(self):
+        etag = self.client.get('/api/observations/')['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/observations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # only the MAX/COUNT aggregate
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_list_etag_changes_on_delete(self):
+        etag = self.client.get(f'/api/patients/{self.patient.id}/observations/')['ETag']
+        Observation.objects.first().delete()
+        response = self.client.get(f'/api/patients/{self.patient.id}/observations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_list_ignores_if_modified_since(self):
+        first = self.client.get('/api/observations/')
+        self.assertNotIn('Last-Modified', first)
+        # an older row going away leaves MAX(updated_at) where it was
+        Observation.objects.order_by('updated_at').first().delete()
+        response = self.client.get('/api/observations/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['entry']), 2)
+
+
+class SymptomTrendTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def log(self, symptom, severity, when):
+        code, display = Observation.SYMPTOM_CODES[symptom]
+        Observation.objects.create(
+            patient=self.patient, status='final', code=code, code_display=display,
+            value_quantity=severity, effective_date_time=when)
+
+    def test_daily_buckets_and_rolling_mean(self):
+        day = datetime(2025, 4, 1, 9, 0, tzinfo=dt_timezone.utc)
+        self.log('headache', 2, day)
+        self.log('headache', 4, day + timedelta(hours=5))
+        self.log('headache', 9, day + timedelta(days=3))
+        # 10 days later, outside the 7 day window of the others
+        self.log('headache', 1, day + timedelta(days=10))
+        self.log('sadness', 5, day)
+
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/patients/{self.patient.id}/symptom-trends/').json()
+        # cold token cache (token, patient), the patient object and one trend query
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+
+        series = {s['display']: s for s in data['series']}
+        headache = series['Headache']
+        self.assertEqual(headache['date'], ['2025-04-01', '2025-04-04', '2025-04-11'])
+        self.assertEqual(headache['mean'], [3.0, 9.0, 1.0])
+        self.assertEqual(headache['max'], [4.0, 9.0, 1.0])
+        self.assertEqual(headache['count'], [2, 1, 1])
+        self.assertEqual(headache['rolling7Mean'], [3.0, 5.0, 1.0])
+        self.assertEqual(series['Sadness']['count'], [1])
+
+    def test_weekly_and_code_filter(self):
+        day = datetime(2025, 4, 1, 9, 0, tzinfo=dt_timezone.utc)
+        self.log('headache', 2, day)
+        self.log('headache', 6, day + timedelta(days=1))
+        self.log('sadness', 5, day)
+        code = Observation.SYMPTOM_CODES['headache'][0]
+        data = self.client.get(f'/api/patients/{self.patient.id}/symptom-trends/?bucket=week&code={code}').json()
+        self.assertEqual(len(data['series']), 1)
+        self.assertEqual(data['series'][0]['date'], ['2025-03-31'])
+        self.assertEqual(data['series'][0]['mean'], [4.0])
+
+    def test_bad_bucket(self):
+        response = self.client.get(f'/api/patients/{self.patient.id}/symptom-trends/?bucket=hour')
+        self.assertEqual(response.status_code, 400)
+
+    def test_date_range(self):
+        day = datetime(2025, 4, 1, 9, 0, tzinfo=dt_timezone.utc)
+        self.log('headache', 2, day)
+        self.log('headache', 6, day + timedelta(days=3))
+        url = f'/api/patients/{self.patient.id}/symptom-trends/'
+        data = self.client.get(url + '?start_date=2025-04-02&end_date=2025-04-05').json()
+        self.assertEqual(data['series'][0]['mean'], [6.0])
+        for query in ('start_date=garbage', 'end_date=2025-13-45'):
+            self.assertEqual(self.client.get(f'{url}?{query}').status_code, 400, query)
+
+
+class SymptomRollupTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.day = datetime(2025, 4, 1, 9, 0, tzinfo=dt_timezone.utc)
+        self.headache = Observation.SYMPTOM_CODES['headache'][0]
+
+    def summaries(self):
+        return {
+            (s.code, s.day): (s.count, s.total, s.max_value)
+            for s in DailySymptomSummary.objects.filter(patient=self.patient)
+        }
+
+    def test_log_symptoms_updates_rollup(self):
+        self.client.post('/api/symptoms/', {'symptoms': [
+            {'symptom': 'headache', 'severity': 3, 'effectiveDateTime': self.day.isoformat()},
+            {'symptom': 'headache', 'severity': 7, 'effectiveDateTime': (self.day + timedelta(hours=2)).isoformat()},
+        ]}, format='json')
+        self.assertEqual(self.summaries(), {(self.headache, date(2025, 4, 1)): (2, 10.0, 7.0)})
+
+    def test_locks_the_patient_before_recomputing(self):
+        # the lock is a postgres advisory lock, under sqlite this only checks it's asked for
+        with mock.patch('postpartum_api.rollups.lock_patients') as lock:
+            self.client.post('/api/symptoms/', {'symptoms': ['headache'], 'severity': 3}, format='json')
+        self.assertEqual(list(lock.call_args.args[0]), [self.patient.id])
+
+    def test_viewset_update_and_delete(self):
+        response = self.client.post('/api/observations/', fhir_observation('headache', 4) | {
+            'effectiveDateTime': self.day.isoformat()}, format='json')
+        observation_id = response.json()['id']
+        self.assertEqual(self.summaries(), {(self.headache, date(2025, 4, 1)): (1, 4.0, 4.0)})
+
+        # moving it to another day empties the old summary row
+        self.client.patch(f'/api/observations/{observation_id}/', {
+            'effective_date_time': (self.day + timedelta(days=1)).isoformat()}, format='json')
+        self.assertEqual(self.summaries(), {(self.headache, date(2025, 4, 2)): (1, 4.0, 4.0)})
+
+        self.client.delete(f'/api/observations/{observation_id}/')
+        self.assertEqual(self.summaries(), {})
+
+    def test_rebuild_command(self):
+        add_observations(self.patient, 5)
+        DailySymptomSummary.objects.all().delete()
+        call_command('rebuild_symptom_rollups', workers=1, chunk_size=1, stdout=io.StringIO())
+        self.assertEqual(sum(count for count, total, maximum in self.summaries().values()), 5)
+
+    def test_cohort_summary_is_staff_only(self):
+        other = make_patient('other')[2]
+        for patient, severity in ((self.patient, 2), (other, 6)):
+            Observation.objects.create(
+                patient=patient, status='final', code=self.headache, code_display='Headache',
+                value_quantity=severity, effective_date_time=self.day)
+        call_command('rebuild_symptom_rollups', stdout=io.StringIO())
+
+        self.assertEqual(self.client.get('/api/cohort/symptom-summary/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        data = self.client.get('/api/cohort/symptom-summary/').json()
+        self.assertEqual(data['series'][0]['patients'], [2])
+        self.assertEqual(data['series'][0]['mean'], [4.0])
+        self.assertEqual(data['series'][0]['max'], [6.0])
+        self.assertEqual(self.client.get('/api/cohort/symptom-summary/?start_date=garbage').status_code, 400)
+        data = self.client.get(f'/api/cohort/symptom-summary/?start_date={(self.day + timedelta(days=1)).date()}').json()
+        self.assertEqual(data['series'], [])
+
+
+class RiskFlagTests(TestCase):
+    def setUp(self):
+        self.now = datetime(2025, 4, 15, 12, 0, tzinfo=dt_timezone.utc)
+        self.patient = make_patient()[2]
+
+    def log(self, patient, symptom, severities):
+        code, display = Observation.SYMPTOM_CODES[symptom]
+        for days_ago, severity in severities:
+            Observation.objects.create(
+                patient=patient, status='final', code=code, code_display=display,
+                value_quantity=severity, effective_date_time=self.now - timedelta(days=days_ago))
+
+    def flags(self):
+        return {(f.patient_id, f.code, f.rule) for f in RiskFlag.objects.all()}
+
+    def test_rules(self):
+        other = make_patient('other')[2]
+        bleeding = Observation.SYMPTOM_CODES['bleeding'][0]
+        sadness = Observation.SYMPTOM_CODES['sadness'][0]
+        # one very heavy reading
+        self.log(self.patient, 'bleeding', [(1, 9)])
+        # sadness climbing a point a day, never above the threshold
+        self.log(other, 'sadness', [(4, 2), (3, 3), (2, 4), (1, 5), (0, 6)])
+        # headache isn't a risk symptom
+        self.log(other, 'headache', [(0, 10)])
+        # too old to count
+        self.log(other, 'bleeding', [(30, 10)])
+
+        flag_cohort(now=self.now)
+        self.assertEqual(self.flags(), {
+            (self.patient.id, bleeding, 'threshold'),
+            (other.id, sadness, 'trend'),
+        })
+        trend = RiskFlag.objects.get(rule='trend')
+        self.assertAlmostEqual(trend.value, 1.0)
+        self.assertEqual(trend.observation_count, 5)
+
+    def test_persistence_and_rerun_replaces_flags(self):
+        chest_pain = Observation.SYMPTOM_CODES['chest-pain'][0]
+        self.log(self.patient, 'chest-pain', [(3, 5), (1, 5)])
+        flag_cohort(now=self.now)
+        self.assertEqual(self.flags(), {(self.patient.id, chest_pain, 'persistence')})
+
+        Observation.objects.all().delete()
+        flag_cohort(now=self.now)
+        self.assertEqual(self.flags(), set())
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_second_request_skips_token_and_patient(self):
+        self.client.get('/api/patients/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/symptoms/', {'symptoms': ['headache']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        tables = ' '.join(q['sql'] for q in ctx.captured_queries)
+        self.assertNotIn('authtoken_token', tables)
+        self.assertNotIn('FROM "postpartum_api_patient"', tables)
+
+    def test_deleted_token_is_rejected(self):
+        self.assertEqual(self.client.get('/api/patients/').status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/patients/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get('/api/patients/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/patients/').status_code, 401)
+
+
+class PatientResolverTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        # session login, so the token cache doesn't hand over the patient
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+    def patient_queries(self, ctx):
+        return [q for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "postpartum_api_patient"' in q['sql']]
+
+    def test_write_looks_patient_up_once(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/observations/', fhir_observation('headache', 4), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(self.patient_queries(ctx)), 1)
+
+    @override_settings(TIMELINE_CACHE_ENABLED=False)
+    def test_lists_filter_on_patient_id(self):
+        add_observations(self.patient, 2)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/observations/')
+            self.client.get('/api/questionnaire-responses/')
+        self.assertFalse([q for q in ctx.captured_queries if 'JOIN "postpartum_api_patient"' in q['sql']])
+
+
+class ProvenanceWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.patient = make_patient()[2]
+        add_observations(self.patient, 1)
+        self.observation = Observation.objects.get()
+
+    def test_no_events_lost_under_concurrent_writes(self):
+        writer = ProvenanceWriter(batch_size=50, wait=0.01)
+
+        def write(n):
+            for i in range(n):
+                writer.put([Provenance(observation=self.observation, user=self.patient, action='create', reason=str(i))])
+
+        threads = [threading.Thread(target=write, args=(100,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+        self.assertEqual(Provenance.objects.count(), 800)
+
+    def test_full_queue_writes_inline(self):
+        writer = ProvenanceWriter(max_size=2)
+        # no writer thread yet, so the queue can't drain
+        writer.start = lambda: None
+        writer.put([Provenance(observation=self.observation, user=self.patient, action='create') for _ in range(5)])
+        self.assertEqual(writer.queue.qsize(), 2)
+        self.assertEqual(Provenance.objects.count(), 3)
+
+        ProvenanceWriter.start(writer)
+        writer.stop()
+        self.assertEqual(Provenance.objects.count(), 5)
+
+    def test_rolled_back_write_records_nothing(self):
+        class Rollback(Exception):
+            pass
+
+        with self.assertRaises(Rollback):
+            with transaction.atomic():
+                record_provenance([Provenance(observation=self.observation, user=self.patient, action='create')])
+                raise Rollback
+        self.assertFalse(Provenance.objects.exists())
+
+
+@override_settings(TIMELINE_CACHE_ENABLED=False)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def follow(self, url):
+        entries = []
+        while url:
+            bundle = self.client.get(url).json()
+            entries += bundle['entry']
+            url = next((link['url'] for link in bundle['link'] if link['relation'] == 'next'), None)
+        return entries
+
+    def test_observation_pages_match_sync(self):
+        add_observations(self.patient, 5)
+        self.assertEqual(
+            self.follow('/api/async/observations/?_count=2'),
+            self.client.get('/api/observations/').json()['entry'])
+
+    def test_questionnaire_responses_match_sync(self):
+        questionnaire = Questionnaire.objects.create(
+            identifier='q', version='1', name='q', title='q', status='active')
+        add_responses(self.patient, questionnaire, 3)
+        self.assertEqual(
+            self.follow('/api/async/questionnaire-responses/?_count=2'),
+            self.client.get('/api/questionnaire-responses/').json()['entry'])
+
+    def test_patient_detail(self):
+        self.assertEqual(
+            self.client.get(f'/api/async/patients/{self.patient.id}/').json(),
+            self.client.get(f'/api/patients/{self.patient.id}/').json())
+        other = make_patient('other')[2]
+        self.assertEqual(self.client.get(f'/api/async/patients/{other.id}/').status_code, 404)
+
+    def test_needs_token(self):
+        self.assertEqual(APIClient().get('/api/async/observations/').status_code, 401)
+
+    def test_bad_cursor_is_400(self):
+        not_uuid = base64.urlsafe_b64encode(b'2025-04-01T08:00:00+00:00|42').decode('ascii')
+        for cursor in ('%%%', not_uuid):
+            self.assertEqual(self.client.get(f'/api/async/observations/?cursor={cursor}').status_code, 400)
+
+    def test_date_filter(self):
+        add_observations(self.patient, 5)
+        since = timezone.localtime(timezone.now() - timedelta(hours=2, minutes=30)).strftime('%Y-%m-%dT%H:%M:%S')
+        self.assertEqual(len(self.follow(f'/api/async/observations/?start_date={since}')), 3)
+
+    def test_bad_date_filter_is_400(self):
+        for query in ('start_date=garbage', 'end_date=2025-02-30T00:00:00'):
+            self.assertEqual(self.client.get(f'/api/async/observations/?{query}').status_code, 400, query)
+
+
+# stands in for Google's discovery, token and keys endpoints
+class StubGoogle(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, data, cache_control='public, max-age=3600'):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.hits.append(self.path)
+        server.connections.add(self.client_address)
+        if self.path == '/.well-known/openid-configuration':
+            self.send_json({
+                'issuer': server.base_url,
+                'token_endpoint': server.base_url + '/token',
+                'jwks_uri': server.base_url + '/certs',
+            })
+        else:
+            self.send_json({'keys': [server.jwk]})
+
+    def do_POST(self):
+        server = self.server
+        server.hits.append(self.path)
+        server.connections.add(self.client_address)
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(server.delay)
+        self.send_json({'id_token': server.id_token}, cache_control='no-store')
+
+    def log_message(self, *args):
+        pass
+
+
+class GoogleOAuthTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import jwt
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        cls.jwt = jwt
+        cls.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGoogle)
+        cls.server.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.server.jwk = dict(jwt.algorithms.RSAAlgorithm.to_jwk(cls.key.public_key(), as_dict=True), kid='stub')
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.server.hits = []
+        self.server.connections = set()
+        self.server.delay = 0
+        self.server.id_token = self.id_token(self.key)
+        settings = override_settings(
+            GOOGLE_OAUTH2_DISCOVERY_URL=self.server.base_url + '/.well-known/openid-configuration',
+            GOOGLE_OAUTH2_CLIENT_ID='client-id',
+            GOOGLE_OAUTH2_TIMEOUT=(1, 0.5),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def id_token(self, key, **extra):
+        now = int(time.time())
+        claims = {'iss': self.server.base_url, 'aud': 'client-id', 'iat': now, 'exp': now + 600,
+                  'email': 'new.mom@example.com', 'email_verified': True, 'given_name': 'New', 'family_name': 'Mom',
+                  'nonce': getattr(self, 'nonce', None), **extra}
+        return self.jwt.encode(claims, key, algorithm='RS256', headers={'kid': 'stub'})
+
+    # google_login keeps a nonce in the session, Google echoes it in the id token
+    def start_sign_in(self, **extra):
+        location = self.client.get('/api/google/login/')['Location']
+        self.nonce = location.split('&nonce=')[1]
+        self.server.id_token = self.id_token(self.key, **extra)
+
+    def test_sign_in_reuses_connection_and_cached_documents(self):
+        for _ in range(2):
+            self.start_sign_in()
+            response = self.client.get('/api/accounts/google/login/callback/?code=abc')
+            self.assertTrue(response['Location'].startswith('/api/test/?token='))
+        self.assertEqual(User.objects.get().email, 'new.mom@example.com')
+        self.assertTrue(Patient.objects.filter(user__email='new.mom@example.com').exists())
+        self.assertEqual(self.server.hits, ['/.well-known/openid-configuration', '/token', '/certs', '/token'])
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_bad_signature_is_rejected(self):
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        self.start_sign_in()
+        self.server.id_token = self.id_token(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+        response = self.client.get('/api/accounts/google/login/callback/?code=abc')
+        self.assertEqual(response['Location'], '/api/login/')
+        self.assertFalse(User.objects.exists())
+
+    def test_slow_token_endpoint_times_out(self):
+        self.server.delay = 2
+        self.start_sign_in()
+        start = time.perf_counter()
+        response = self.client.get('/api/accounts/google/login/callback/?code=abc')
+        self.assertEqual(response['Location'], '/api/login/')
+        self.assertLess(time.perf_counter() - start, 1.5)
+
+    def test_nonce_and_verified_email_are_required(self):
+        # no sign in started from this session
+        self.nonce = 'guessed'
+        self.server.id_token = self.id_token(self.key)
+        self.assertEqual(self.client.get('/api/accounts/google/login/callback/?code=abc')['Location'], '/api/login/')
+        # a token minted for another sign in
+        self.start_sign_in(nonce='other')
+        self.assertEqual(self.client.get('/api/accounts/google/login/callback/?code=abc')['Location'], '/api/login/')
+        self.start_sign_in(email_verified=False)
+        self.assertEqual(self.client.get('/api/accounts/google/login/callback/?code=abc')['Location'], '/api/login/')
+        self.assertFalse(User.objects.exists())
+
+    def test_async_callback(self):
+        self.start_sign_in()
+        response = self.client.get('/api/accounts/google/login/callback/async/?code=abc')
+        self.assertTrue(response['Location'].startswith('/api/test/?token='))
+        self.assertTrue(User.objects.filter(email='new.mom@example.com').exists())
+
+        # a nonce is only good once, and errors past the token check redirect too
+        response = self.client.get('/api/accounts/google/login/callback/async/?code=abc')
+        self.assertEqual(response['Location'], '/api/login/')
+        self.start_sign_in()
+        self.server.id_token = 'not a jwt'
+        response = self.client.get('/api/accounts/google/login/callback/async/?code=abc')
+        self.assertEqual(response['Location'], '/api/login/')
+
+
+class ObservationSearchTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.headache = Observation.SYMPTOM_CODES['headache'][0]
+        self.sadness = Observation.SYMPTOM_CODES['sadness'][0]
+        day = datetime(2025, 4, 1, 9, 0, tzinfo=dt_timezone.utc)
+        for code, severity, when in ((self.headache, 2, day), (self.headache, 8, day + timedelta(days=1)),
+                                     (self.sadness, 5, day + timedelta(days=2))):
+            Observation.objects.create(patient=self.patient, status='final', code=code, code_display='x',
+                                       value_quantity=severity, effective_date_time=when)
+
+    def search(self, query):
+        response = self.client.get('/api/observations/?' + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [entry['resource'] for entry in response.json()['entry']]
+
+    def test_filters(self):
+        self.assertEqual(len(self.search(f'code=http://snomed.info/sct|{self.headache}')), 2)
+        self.assertEqual(len(self.search(f'code={self.headache},{self.sadness}')), 3)
+        self.assertEqual(len(self.search('date=2025-04-02')), 1)
+        self.assertEqual(len(self.search('date=ge2025-04-02&date=lt2025-04-03')), 1)
+        self.assertEqual(len(self.search('date=gt2025-04-01')), 2)
+        self.assertEqual(len(self.search('value-quantity=ge5')), 2)
+        self.assertEqual(len(self.search('status=preliminary')), 0)
+        self.assertEqual(len(self.search(f'patient={self.patient.id}')), 3)
+        # someone else's patient id doesn't widen the search
+        other = make_patient('other')[2]
+        add_observations(other, 1)
+        self.assertEqual(len(self.search(f'patient=Patient/{other.id}')), 0)
+
+    def test_sort_and_count(self):
+        values = [r['valueQuantity']['value'] for r in self.search('_sort=-value-quantity&_count=2')]
+        self.assertEqual(values, [8.0, 5.0])
+        response = self.client.get('/api/observations/?_sort=-value-quantity&_count=2').json()
+        next_url = next(link['url'] for link in response['link'] if link['relation'] == 'next')
+        last = self.client.get(next_url).json()['entry']
+        self.assertEqual([e['resource']['valueQuantity']['value'] for e in last], [2.0])
+
+    def pages(self, url, relation):
+        ids = []
+        while url:
+            bundle = self.client.get(url).json()
+            ids.append([entry['resource']['id'] for entry in bundle['entry']])
+            url = next((link['url'] for link in bundle['link'] if link['relation'] == relation), None)
+        return ids
+
+    def test_pages_through_ties_on_the_sort_column(self):
+        # every row has status final, the cursor carries the id too so the walk still ends
+        add_observations(self.patient, 25)
+        pages = self.pages('/api/observations/?_sort=status,-value-quantity&_count=10', 'next')
+        self.assertEqual([len(page) for page in pages], [10, 10, 8])
+        forward = [pk for page in pages for pk in page]
+        self.assertEqual(len(set(forward)), 28)
+
+        last = self.client.get('/api/observations/?_sort=status,-value-quantity&_count=10').json()
+        for _ in range(2):
+            last = self.client.get(next(link['url'] for link in last['link'] if link['relation'] == 'next')).json()
+        previous = next(link['url'] for link in last['link'] if link['relation'] == 'previous')
+        backward = self.pages(previous, 'previous')
+        self.assertEqual([pk for page in reversed(backward) for pk in page], forward[:20])
+
+    def test_bad_cursor_is_400(self):
+        for cursor in ('%%%', base64.urlsafe_b64encode(b'{"p": ["x"]}').decode()):
+            response = self.client.get(f'/api/observations/?cursor={cursor}')
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_summary_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(f'/api/observations/?_summary=count&code={self.headache}').json()
+        self.assertEqual(data, {"resourceType": "Bundle", "type": "searchset", "total": 2})
+        self.assertFalse([q for q in ctx.captured_queries if 'value_quantity' in q['sql']])
+
+    def test_elements_trim_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resources = self.search('_elements=code,effectiveDateTime')
+        self.assertEqual(set(resources[0]), {'resourceType', 'id', 'meta', 'code', 'effectiveDateTime'})
+        self.assertEqual(resources[0]['meta']['tag'][0]['code'], 'SUBSETTED')
+        rows = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'LIMIT' in q['sql']]
+        self.assertNotIn('value_quantity', rows[0])
+
+    def test_bad_parameters(self):
+        for query in ('date=yesterday', 'date=ge2025-13-45', 'date=ge2025-02-30T00:00:00', 'value-quantity=lots',
+                      '_sort=color', '_summary=text', '_elements=note', 'patient=nobody'):
+            response = self.client.get('/api/observations/?' + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json()['resourceType'], 'OperationOutcome')
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def selects(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, ' '.join(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT'))
+
+    def test_detail_skips_unused_columns(self):
+        add_observations(self.patient, 1)
+        observation = Observation.objects.get()
+        observation.notes = 'x' * 1000
+        observation.save()
+        response, sql = self.selects(f'/api/observations/{observation.id}/')
+        self.assertEqual(response.json(), ObservationSerializer(observation).data)
+        self.assertNotIn('"notes"', sql)
+
+        # writes still see every column
+        response = self.client.patch(f'/api/observations/{observation.id}/', {'value_quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Observation.objects.get().notes, 'x' * 1000)
+
+    def test_questionnaire_elements(self):
+        Questionnaire.objects.create(identifier='q1', version='1', name='q1', title='Q1', status='active',
+                                     description='long text ' * 100)
+        response, sql = self.selects('/api/questionnaires/?_elements=title')
+        resource = response.json()[0]
+        self.assertEqual(set(resource), {'resourceType', 'id', 'meta', 'title'})
+        self.assertEqual(resource['meta']['tag'][0]['code'], 'SUBSETTED')
+        self.assertNotIn('"description"', sql)
+
+        response = self.client.get('/api/questionnaires/?_elements=text')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['resourceType'], 'OperationOutcome')
+
+
+@override_settings(PROVENANCE_ASYNC=False)
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.user, self.token, self.patient = make_patient()
+        self.url = f'/api/patients/{self.patient.id}/observations/stream/'
+        self.headers = {'Authorization': 'Token ' + self.token.key}
+
+    def log(self, *symptoms):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.headers['Authorization'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/symptoms/', {'symptoms': list(symptoms), 'severity': 4}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    async def next_chunk(self, stream):
+        return (await asyncio.wait_for(anext(stream), 5)).decode('utf-8')
+
+    async def test_pushes_new_observations(self):
+        response = await self.async_client.get(self.url, headers=self.headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertEqual(await self.next_chunk(stream), 'retry: 3000\n\n')
+
+        await sync_to_async(self.log)('headache')
+        chunk = await self.next_chunk(stream)
+        self.assertIn('event: Observation\n', chunk)
+        data = json.loads(chunk.split('data: ')[1])
+        self.assertEqual(data['subject']['reference'], f'Patient/{self.patient.id}')
+        await stream.aclose()
+
+    async def test_resumes_after_last_event_id(self):
+        await sync_to_async(self.log)('headache', 'sadness')
+        ids = [row async for row in Observation.objects.order_by('created_at', 'id').values('id', 'created_at')]
+        response = await self.async_client.get(
+            self.url, headers={**self.headers, 'Last-Event-ID': event_id('Observation', ids[0])})
+        stream = response.streaming_content
+        await self.next_chunk(stream)
+        chunk = await self.next_chunk(stream)
+        self.assertIn(f'id: {event_id("Observation", ids[1])}\n', chunk)
+        await stream.aclose()
+
+    async def test_needs_own_patient(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        other = await sync_to_async(make_patient)('other')
+        response = await self.async_client.get(self.url, headers={'Authorization': 'Token ' + other[1].key})
+        self.assertEqual(response.status_code, 404)
+        # the token only counts in the header, urls end up in access logs
+        response = await self.async_client.get(f'{self.url}?token={self.token.key}')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_session_cookie(self):
+        # what a browser's EventSource sends after signing in with Google
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        stream = response.streaming_content
+        self.assertEqual(await self.next_chunk(stream), 'retry: 3000\n\n')
+        await stream.aclose()
+
+    def test_refused_under_wsgi(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.headers['Authorization'])
+        self.assertEqual(response.status_code, 501)
+
+
+# stands in for a downstream system, answers with the queued status codes then 200
+class StubReceiver(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server.received.append((dict(self.headers), body))
+        status = server.statuses.pop(0) if server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(PROVENANCE_ASYNC=False, SUBSCRIPTION_BATCH_SIZE=2)
+class SubscriptionTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubReceiver)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.received = []
+        self.server.statuses = []
+        self.user, self.token, self.patient = make_patient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.subscription = Subscription.objects.create(
+            code=Observation.SYMPTOM_CODES['bleeding'][0], min_value=7, header='Authorization: Bearer abc',
+            endpoint=f'http://127.0.0.1:{self.server.server_port}/notify')
+
+    def log(self, *entries):
+        response = self.client.post('/api/symptoms/', {'symptoms': [
+            {'symptom': symptom, 'severity': severity} for symptom, severity in entries]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_matches_in_bulk_and_batches_per_endpoint(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.log(('bleeding', 8), ('bleeding', 9), ('bleeding', 3), ('sadness', 9), ('bleeding', 7))
+        self.assertEqual(len([q for q in ctx.captured_queries if 'postpartum_api_subscription"' in q['sql']
+                              and q['sql'].startswith('SELECT')]), 1)
+        self.assertEqual(SubscriptionDelivery.objects.count(), 3)
+
+        self.assertEqual(dispatcher.dispatch_due(), 3)
+        self.assertEqual(sorted(len(body['entry']) for headers, body in self.server.received), [1, 2])
+        headers, body = self.server.received[0]
+        self.assertEqual(headers['Authorization'], 'Bearer abc')
+        self.assertEqual(headers['X-Subscription-Id'], str(self.subscription.id))
+        self.assertEqual(body['type'], 'history')
+        self.assertEqual(body['entry'][0]['resource']['resourceType'], 'Observation')
+        self.assertEqual(SubscriptionDelivery.objects.filter(status='delivered').count(), 3)
+
+    def test_retries_with_backoff(self):
+        self.server.statuses = [503]
+        response = self.client.post('/api/observations/', {
+            'status': 'final', 'code': Observation.SYMPTOM_CODES['bleeding'][0], 'code_display': 'Bleeding',
+            'value_quantity': 8, 'value_unit': '1-10', 'effective_date_time': timezone.now().isoformat()
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        dispatcher.dispatch_due()
+        delivery = SubscriptionDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts), ('pending', 1))
+        self.assertIn('503', delivery.last_error)
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+        # not due yet
+        self.assertEqual(dispatcher.dispatch_due(), 0)
+
+        SubscriptionDelivery.objects.update(next_attempt_at=timezone.now())
+        dispatcher.dispatch_due()
+        self.assertEqual(SubscriptionDelivery.objects.get().status, 'delivered')
+        self.assertEqual(len(self.server.received), 2)
+
+    def test_matches_values_sent_as_strings(self):
+        response = self.client.post('/api/symptoms/', {'symptoms': ['bleeding'], 'severity': '8'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SubscriptionDelivery.objects.count(), 1)
+        # nothing to compare, nothing matched, the observations are still saved
+        observation = Observation(code=self.subscription.code, value_quantity='n/a')
+        self.assertEqual(match_subscriptions([observation]), [])
+
+    @override_settings(SUBSCRIPTION_WORKERS=1)
+    def test_renews_the_lease_of_unsent_batches(self):
+        self.log(('bleeding', 8), ('bleeding', 9), ('bleeding', 10))
+        with mock.patch('postpartum_api.subscriptions.renew_lease', wraps=renew_lease) as renew:
+            self.assertEqual(dispatcher.dispatch_due(), 3)
+        # after the first batch went out, the one still waiting was leased again
+        self.assertEqual(len(self.server.received), 2)
+        sent_first = {entry['fullUrl'].split('/')[1] for entry in self.server.received[0][1]['entry']}
+        renewed = {str(SubscriptionDelivery.objects.get(id=pk).observation_id) for pk in renew.call_args_list[0].args[0]}
+        self.assertEqual(len(renewed), 3 - len(sent_first))
+        self.assertFalse(renewed & sent_first)
+        self.assertEqual(SubscriptionDelivery.objects.filter(status='delivered').count(), 3)
+
+    @override_settings(SUBSCRIPTION_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        self.server.statuses = [500, 500]
+        self.log(('bleeding', 10))
+        for _ in range(2):
+            dispatcher.dispatch_due()
+            SubscriptionDelivery.objects.filter(status='pending').update(next_attempt_at=timezone.now())
+        delivery = SubscriptionDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts), ('failed', 2))
+        self.assertEqual(dispatcher.dispatch_due(), 0)
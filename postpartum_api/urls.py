@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 # sets up API routes
 router = DefaultRouter()
+router.APIRootView = views.BundleRootView
 router.register(r'patients', views.PatientViewSet, basename='patient')
 router.register(r'observations', views.ObservationViewSet, basename='observation')
 router.register(r'questionnaires', views.QuestionnaireViewSet, basename='questionnaire')
@@ -17,7 +18,19 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('google/login/', views.google_login, name='google_login'),
     path('accounts/google/login/callback/', views.google_callback_view, name='google_callback'),
+    path('accounts/google/login/callback/async/', async_views.google_callback, name='google_callback_async'),
     # app pages
     path('test/', views.test_page, name='test_page'),
     path('symptoms/', views.log_symptoms, name='log_symptoms'),
+    # bulk data
+    path('$export', views.bulk_export, name='bulk_export'),
+    # async read endpoints for ASGI deployments
+    path('async/observations/', async_views.observation_list, name='async_observation_list'),
+    path('async/patients/<uuid:pk>/', async_views.patient_detail, name='async_patient_detail'),
+    path('async/questionnaire-responses/', async_views.questionnaire_response_list,
+         name='async_questionnaire_response_list'),
+    # live feed, Server-Sent Events
+    path('patients/<uuid:pk>/observations/stream/', async_views.observation_stream, name='observation_stream'),
+    # cohort analytics
+    path('cohort/symptom-summary/', views.cohort_symptom_summary_view, name='cohort_symptom_summary'),
 ] 
\ No newline at end of file
@@ -1,23 +1,41 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from rest_framework import viewsets, status
+from rest_framework.routers import APIRootView
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.db.models import Prefetch
 from .models import Patient, Observation, Questionnaire, QuestionnaireResponse, QuestionnaireResponseItem, Provenance
 from .serializers import PatientSerializer, ObservationSerializer, QuestionnaireSerializer, QuestionnaireResponseSerializer
+from .pagination import ObservationPagination, QuestionnaireResponsePagination
+from .bundles import observation_data_from_fhir, process_bundle
+from .export import EXPORT_TYPES, export_ndjson
+from .fast_serializers import FastObservationSerializer, FastQuestionnaireSerializer, FastQuestionnaireResponseSerializer
+from .fieldsets import SparseFieldsMixin
+from .search import search_observations, search_ordering, search_summary, search_elements, parse_when, date_range
+from .analytics import BUCKETS, symptom_trends, cohort_symptom_summary
+from .conditional import ConditionalGetMixin, conditional_list
+from .rollups import refresh_rollups, rollup_key
+from .authentication import current_patient, current_patient_id
+from .audit import record_provenance
+from .events import publish_created
+from .subscriptions import notify_subscriptions
+from .caching import (
+    timeline_cache_enabled, timeline_etag, etag_matches,
+    get_cached_timeline, set_cached_timeline, invalidate_timeline
+)
 import json
-import base64
 import secrets
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.text import compress_sequence
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import login, authenticate
-import requests
-from datetime import date, datetime
+from datetime import date
 from django.utils import timezone
+from django.db import transaction
 from rest_framework.authtoken.models import Token
-import os
 
 # Create your views here.
 
@@ -37,8 +55,9 @@ def google_login(request):
     request.session['oauth_nonce'] = nonce
     
     # from settings or from env variables
-    client_id = getattr(settings, 'GOOGLE_OAUTH2_CLIENT_ID', os.environ.get('GOOGLE_OAUTH2_CLIENT_ID', ''))
-    redirect_uri = getattr(settings, 'GOOGLE_OAUTH2_REDIRECT_URI', os.environ.get('GOOGLE_OAUTH2_REDIRECT_URI', 'https://cs6440-healthinform.onrender.com/api/accounts/google/login/callback/'))
+    # google_oauth (PyJWT, cryptography) is imported on first use, not at startup
+    from .google_oauth import client_config
+    client_id, client_secret, redirect_uri = client_config()
     
     # builds google url with app
     google_auth_url = (
@@ -56,66 +75,13 @@ def google_callback_view(request):
     if not code:
         return redirect('/api/login/')
     
+    from .google_oauth import google_sign_in, user_for_claims
     try:
-        client_id = getattr(settings, 'GOOGLE_OAUTH2_CLIENT_ID', os.environ.get('GOOGLE_OAUTH2_CLIENT_ID', ''))
-        client_secret = getattr(settings, 'GOOGLE_OAUTH2_CLIENT_SECRET', os.environ.get('GOOGLE_OAUTH2_CLIENT_SECRET', ''))
-        redirect_uri = getattr(settings, 'GOOGLE_OAUTH2_REDIRECT_URI', os.environ.get('GOOGLE_OAUTH2_REDIRECT_URI', 'https://cs6440-healthinform.onrender.com/api/accounts/google/login/callback/'))
-
-        # get token  
-        token_url = 'https://oauth2.googleapis.com/token'
-        token_data = {
-            'code': code,
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'redirect_uri': redirect_uri,
-            'grant_type': 'authorization_code'
-        }
+        # token exchange and id token check against Google's keys
+        claims = google_sign_in(code, request.session.pop('oauth_nonce', None))
         
-        # call google API
-        token_response = requests.post(token_url, data=token_data)
-        
-        if token_response.status_code != 200:
-            return redirect('/api/login/')
-        
-        token_info = token_response.json()
-        id_token = token_info.get('id_token')
-        
-        # decode token 
-        token_parts = id_token.split('.')
-        user_data_part = token_parts[1]
-        
-        # padding for base64 decoding
-        padding_needed = len(user_data_part) % 4
-        if padding_needed:
-            user_data_part += '=' * (4 - padding_needed)
-            
-        # decode  token for user info
-        user_data = json.loads(base64.b64decode(user_data_part).decode('utf-8'))
-        
-        # user account get/create
-        user, created = User.objects.get_or_create(
-            username=user_data['email'],
-            defaults={
-                'email': user_data['email'],
-                'first_name': user_data.get('given_name', ''),
-                'last_name': user_data.get('family_name', '')}
-        )
-        
-        # patient record get for this user
-        patient, created = Patient.objects.get_or_create(
-            user=user,
-            defaults={
-                'identifier': f"PAT-{user.id}",
-                'name_first': user_data.get('given_name', ''),
-                'name_last': user_data.get('family_name', ''),
-                'gender': 'unknown',
-                'birth_date': datetime.now().date(),
-                'active': True
-            }   
-        )
-        
-        # create auth token
-        token, created = Token.objects.get_or_create(user=user)
+        # user account, patient record and auth token get/create
+        user, token = user_for_claims(claims)
         login(request, user)
         
         return redirect(f'/api/test/?token={token.key}')
@@ -124,7 +90,7 @@ def google_callback_view(request):
         return redirect('/api/login/')
 
 # API for patient data
-class PatientViewSet(viewsets.ModelViewSet):
+class PatientViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = PatientSerializer
     permission_classes = [IsAuthenticated]
     
@@ -137,24 +103,39 @@ class PatientViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def observations(self, request, pk=None):
         patient = self.get_object()
-        observations = Observation.objects.filter(patient=patient)
-        serializer = ObservationSerializer(observations, many=True)
-        return Response(serializer.data)
+        observations = Observation.objects.filter(patient_id=patient.id)
+        return conditional_list(request, observations, lambda: Response(
+            FastObservationSerializer.render(FastObservationSerializer.values(observations))))
 
     @action(detail=True, methods=['get'])
     def questionnaire_responses(self, request, pk=None):
         patient = self.get_object()
-        responses = QuestionnaireResponse.objects.filter(patient=patient)
-        serializer = QuestionnaireResponseSerializer(responses, many=True)
-        return Response(serializer.data)
+        responses = QuestionnaireResponse.objects.filter(patient_id=patient.id)
+        return conditional_list(request, responses, lambda: Response(
+            FastQuestionnaireResponseSerializer.render(FastQuestionnaireResponseSerializer.values(responses))))
+
+    # per-symptom trend arrays, aggregated in the database
+    @action(detail=True, methods=['get'], url_path='symptom-trends')
+    def symptom_trends(self, request, pk=None):
+        patient = self.get_object()
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in BUCKETS:
+            return Response({'error': f"bucket must be one of: {', '.join(BUCKETS)}"}, status=400)
+
+        codes = request.query_params.getlist('code') or None
+        start, end, error = date_range(request.query_params)
+        if error:
+            return Response({'error': error}, status=400)
+        return Response(symptom_trends(patient.id, bucket, codes, start, end))
 
 # track symptoms
-class ObservationViewSet(viewsets.ModelViewSet):
+class ObservationViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = ObservationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ObservationPagination
     
     def get_queryset(self):
-        queryset = Observation.objects.filter(patient__user=self.request.user)
+        queryset = Observation.objects.filter(patient_id=current_patient_id(self.request))
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
         
@@ -164,117 +145,160 @@ class ObservationViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(effective_date_time__lte=end_date)
             
         return queryset
+
+    # serves the patient's timeline from cache, or a 304 if the client's copy is current
+    def list(self, request, *args, **kwargs):
+        patient_id = current_patient_id(request) if timeline_cache_enabled() else None
+        if patient_id is None:
+            return conditional_list(
+                request, self.filter_queryset(self.get_queryset()), lambda: self.list_observations(request))
+
+        # no-cache makes browsers revalidate with If-None-Match on every fetch
+        etag = timeline_etag(patient_id, request.get_full_path())
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        data = get_cached_timeline(patient_id, etag)
+        if data is None:
+            data = self.list_observations(request).data
+            set_cached_timeline(patient_id, etag, data)
+        return Response(data, headers=headers)
+
+    # FHIR search parameters, only for the list
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = search_observations(queryset, self.request.query_params)
+        return queryset
+
+    # lists straight from .values() rows, skips building model instances
+    def list_observations(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        if search_summary(request.query_params) == 'count':
+            return Response({"resourceType": "Bundle", "type": "searchset", "total": queryset.count()})
+
+        elements = search_elements(request.query_params, FastObservationSerializer)
+        if elements is None:
+            page = self.paginate_queryset(FastObservationSerializer.values(queryset))
+            return self.get_paginated_response(FastObservationSerializer.render(page))
+
+        # the cursor needs the sort columns too
+        sort_fields = [field.lstrip('-') for field in search_ordering(request.query_params)]
+        page = self.paginate_queryset(FastObservationSerializer.element_values(queryset, elements, sort_fields))
+        return self.get_paginated_response(FastObservationSerializer.render_elements(page, elements))
     
     def perform_create(self, serializer):
         # save who symptom for
         try:
-            patient = Patient.objects.get(user=self.request.user)
+            patient = current_patient(self.request)
             observation = serializer.save(patient=patient)
             
-            Provenance.objects.create(  #this tracks changes
+            record_provenance([Provenance(  #this tracks changes
                 observation=observation,
                 user=patient,
                 action='create',
                 reason='Created via API'
-            )
+            )])
+            refresh_rollups([rollup_key(observation)])
+            notify_subscriptions([observation])
+            publish_created([observation])
         except Exception as e:
             print(f"Error in perform_create: {e}")
             raise
     
     def perform_update(self, serializer):
-        patient = Patient.objects.get(user=self.request.user)
+        patient = current_patient(self.request)
+        old_key = rollup_key(serializer.instance)
         observation = serializer.save()
         
-        Provenance.objects.create(
+        record_provenance([Provenance(
             observation=observation,
             user=patient,
             action='update',
             reason='Updated via API'
-        )
+        )])
+        # the code or day may have moved, so refresh both summaries
+        refresh_rollups([old_key, rollup_key(observation)])
+
+    def perform_destroy(self, instance):
+        key = rollup_key(instance)
+        instance.delete()
+        refresh_rollups([key])
 
     def create(self, request, *args, **kwargs):
         if request.data.get('resourceType') == 'Observation':
-            data = {}
-            
-            data['status'] = request.data.get('status', 'final')
-            
-            # get just first category 
-            if request.data.get('category'):
-                categories = request.data.get('category', [{}])
-                if len(categories) > 0:
-                    codings = categories[0].get('coding', [{}])
-                    if len(codings) > 0:
-                        data['category'] = codings[0].get('code', '')
-            else:
-                data['category'] = ''
-            
-            # get code and display name
-            if request.data.get('code'):
-                code_info = request.data.get('code', {})
-                codings = code_info.get('coding', [])
-                if len(codings) > 0:
-                    data['code'] = codings[0].get('code', '')
-                    data['code_display'] = codings[0].get('display', '')
-            else:
-                data['code'] = ''
-                data['code_display'] = ''
-            
-            # get severthy number
-            if request.data.get('valueQuantity'):
-                value_info = request.data.get('valueQuantity', {})
-                data['value_quantity'] = value_info.get('value')
-                data['value_unit'] = value_info.get('unit')
-            
-            data['effective_date_time'] = request.data.get('effectiveDateTime', timezone.now())
-            
-            # notes as part of observation model, currentlh not implemented in user interface tho, perhaps for next development?
-            if request.data.get('note'):
-                notes = request.data.get('note', [])
-                if len(notes) > 0:
-                    data['notes'] = notes[0].get('text', '')
-            else:
-                data['notes'] = ''
-            
+            data = observation_data_from_fhir(request.data)
             request.data.clear()
             request.data.update(data)
 
         return super().create(request, *args, **kwargs)
 
 # questionnaire api
-class QuestionnaireViewSet(viewsets.ModelViewSet):
+class QuestionnaireViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = QuestionnaireSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         return Questionnaire.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return conditional_list(request, queryset, lambda: self.list_questionnaires(request, queryset))
+
+    def list_questionnaires(self, request, queryset):
+        elements = search_elements(request.query_params, FastQuestionnaireSerializer)
+        if elements is None:
+            return Response(FastQuestionnaireSerializer.render(FastQuestionnaireSerializer.values(queryset)))
+        rows = FastQuestionnaireSerializer.element_values(queryset, elements)
+        return Response(FastQuestionnaireSerializer.render_elements(rows, elements))
+
     @action(detail=True, methods=['get'])
     def responses(self, request, pk=None):
         # returns all responses for a questionnaire
         questionnaire = self.get_object()
-        responses = QuestionnaireResponse.objects.filter(questionnaire=questionnaire)
-        serializer = QuestionnaireResponseSerializer(responses, many=True)
-        return Response(serializer.data)
+        responses = QuestionnaireResponse.objects.filter(questionnaire_id=questionnaire.id)
+        return conditional_list(request, responses, lambda: Response(
+            FastQuestionnaireResponseSerializer.render(FastQuestionnaireResponseSerializer.values(responses))))
 
 # questionnaire response api
-class QuestionnaireResponseViewSet(viewsets.ModelViewSet):
+class QuestionnaireResponseViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = QuestionnaireResponseSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = QuestionnaireResponsePagination
     
     def get_queryset(self):
-        return QuestionnaireResponse.objects.filter(patient__user=self.request.user)
+        items = QuestionnaireResponseItem.objects.only(*QuestionnaireResponseSerializer.item_read_fields)
+        return QuestionnaireResponse.objects.filter(patient_id=current_patient_id(self.request)).prefetch_related(
+            Prefetch('items', queryset=items))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return conditional_list(request, queryset, lambda: self.list_responses(request, queryset))
+
+    def list_responses(self, request, queryset):
+        page = self.paginate_queryset(FastQuestionnaireResponseSerializer.values(queryset))
+        return self.get_paginated_response(FastQuestionnaireResponseSerializer.render(page))
     
     def perform_create(self, serializer):
-        patient = Patient.objects.get(user=self.request.user)
+        patient = current_patient(self.request)
         response = serializer.save(patient=patient)
         
         # keep track of changes
-        Provenance.objects.create(
+        record_provenance([Provenance(
             questionnaire_response=response,
             user=patient,
             action='create',
             reason='Created via API'
-        )
+        )])
+        publish_created([response])
+
+# api root, also takes FHIR transaction/batch bundles on POST
+class BundleRootView(APIRootView):
+    def post(self, request, *args, **kwargs):
+        patient = current_patient(request)
+        data, status_code = process_bundle(request.data, patient)
+        return Response(data, status=status_code)
 
 #  main app page
 def test_page(request):
@@ -284,17 +308,35 @@ def test_page(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def log_symptoms(request):
-    patient = Patient.objects.get(user=request.user)
+    patient = current_patient(request)
     symptoms = request.data.get('symptoms', [])
-    
-    # save each symptom
+    default_severity = request.data.get('severity', 5)
+    now = timezone.now()
+
+    # symptoms can be plain keys, or {"symptom", "severity", "effectiveDateTime"} entries
+    observations = []
     for symptom in symptoms:
+        severity = default_severity
+        effective = now
+        if isinstance(symptom, dict):
+            severity = symptom.get('severity', default_severity)
+            if symptom.get('effectiveDateTime'):
+                effective = parse_when(str(symptom['effectiveDateTime']))
+                if effective is None:
+                    return Response({'error': f"Invalid effectiveDateTime: {symptom['effectiveDateTime']}"}, status=400)
+                # same rule as ObservationSerializer.validate_effective_date_time
+                if effective > now + timezone.timedelta(minutes=5):
+                    return Response({'error': 'effectiveDateTime cannot be in the far future'}, status=400)
+            symptom = symptom.get('symptom')
+        # checked before anything is written, so one bad entry doesn't lose the batch
+        try:
+            severity = float(severity)
+        except (TypeError, ValueError):
+            return Response({'error': f"Invalid severity: {severity}"}, status=400)
+
         if symptom in Observation.SYMPTOM_CODES:
             code, display = Observation.SYMPTOM_CODES[symptom]
-            severity = request.data.get('severity', 5)
-            
-            # create new symptom
-            observation = Observation.objects.create(
+            observations.append(Observation(
                 patient=patient,
                 status='final',
                 category='vital-signs',
@@ -302,18 +344,62 @@ def log_symptoms(request):
                 code_display=display,
                 value_quantity=severity,
                 value_unit='1-10',
-                effective_date_time=datetime.now()
-            )
-            
-            # keep track of changes
-            Provenance.objects.create(
+                effective_date_time=effective
+            ))
+
+    # save all symptoms in one transaction, provenance is recorded once it commits
+    with transaction.atomic():
+        Observation.objects.bulk_create(observations)
+        record_provenance([
+            Provenance(
                 observation=observation,
                 user=patient,
                 action='create',
                 reason='Created via symptom tracker'
-            )
-    
-    return Response({'status': 'success'})
+            ) for observation in observations
+        ])
+        refresh_rollups([rollup_key(observation) for observation in observations])
+        notify_subscriptions(observations)
+        publish_created(observations)
+    # bulk_create doesn't send post_save
+    invalidate_timeline(patient.id)
+
+    return Response({'status': 'success', 'created': len(observations)})
+
+# daily symptom figures across all patients, staff only
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cohort_symptom_summary_view(request):
+    codes = request.query_params.getlist('code') or None
+    start, end, error = date_range(request.query_params)
+    if error:
+        return Response({'error': error}, status=400)
+    return Response(cohort_symptom_summary(codes, start and start.date(), end and end.date()))
+
+# bulk data export as NDJSON, staff only since it covers every patient
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def bulk_export(request):
+    types = request.query_params.get('_type', ','.join(EXPORT_TYPES)).split(',')
+    unknown = [t for t in types if t not in EXPORT_TYPES]
+    if unknown:
+        return Response({'error': f"Unsupported _type: {', '.join(unknown)}"}, status=400)
+
+    since = None
+    if request.query_params.get('_since'):
+        since = parse_when(request.query_params['_since'])
+        if since is None:
+            return Response({'error': 'Invalid _since'}, status=400)
+
+    lines = export_ndjson(types, since)
+    response = StreamingHttpResponse(content_type='application/fhir+ndjson')
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.streaming_content = compress_sequence(lines)
+        response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+    else:
+        response.streaming_content = lines
+    return response
 
 def api_interface(request):
     return render(request, 'api_interface.html')
@@ -95,8 +95,6 @@ if 'RENDER' in os.environ:
             conn_health_checks=True,
         )
     }
-    # Debug log to help diagnose database connection issues
-    print("Running on Render - Using DATABASE_URL for database connection")
 else:
     # use PostgreSQL database for local run
     DATABASES = {
@@ -106,7 +104,48 @@ else:
             conn_health_checks=True,
         )
     }
-    print("Running locally - Using local database connection")
+
+# Caches
+# locmem is per process, so with several gunicorn workers a shared cache
+# (REDIS_URL, needs the redis package) is needed for the observation timeline cache to stay correct
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+TIMELINE_CACHE_ALIAS = 'default'
+TIMELINE_CACHE_ENABLED = bool(REDIS_URL) or 'RENDER' not in os.environ
+TIMELINE_CACHE_TIMEOUT = 3600
+
+# token -> user/patient cache in each worker, seconds a revoked token can linger in other workers
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TIMEOUT = 60
+
+# write API provenance rows from a background thread, false writes them inline
+PROVENANCE_ASYNC = os.environ.get('PROVENANCE_ASYNC', 'true').lower() == 'true'
+# rows the writer may have queued per worker, past that requests write their own
+PROVENANCE_QUEUE_SIZE = 10000
+
+# fan-out for the live observation stream, blank picks LISTEN/NOTIFY on PostgreSQL and in-process otherwise
+EVENT_BACKEND = os.environ.get('EVENT_BACKEND', '')
+
+# subscription notifications: sender threads per worker, observations per POST,
+# retries with backoff doubling from SUBSCRIPTION_BACKOFF seconds, (connect, read) timeout
+SUBSCRIPTION_WORKERS = 4
+SUBSCRIPTION_BATCH_SIZE = 50
+SUBSCRIPTION_MAX_ATTEMPTS = 8
+SUBSCRIPTION_BACKOFF = 10
+SUBSCRIPTION_TIMEOUT = (3.05, 10)
 
 if not DEBUG:
        SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
@@ -172,15 +211,29 @@ SITE_ID = 1
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        # TokenAuthentication with a per-worker token/user/patient cache
+        'postpartum_api.authentication.CachingTokenAuthentication',
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson backed JSON, falls back to stdlib json if orjson isn't installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'postpartum_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'postpartum_api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# set to False to force stdlib json even when orjson is installed
+USE_ORJSON = os.environ.get('USE_ORJSON', 'true').lower() == 'true'
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -214,6 +267,11 @@ CSRF_EXEMPT_URLS = [
     '/api/auth/token/',
 ]
 
+# Google sign in, oauth_settings.py can override these
+GOOGLE_OAUTH2_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+# (connect, read) seconds for calls to Google, a slow Google shouldn't tie up a worker
+GOOGLE_OAUTH2_TIMEOUT = (3.05, 5)
+
 # Import Google OAuth settings
 try:
     from .oauth_settings import *